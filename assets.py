@@ -0,0 +1,92 @@
+"""
+预定义资源：./predef 下的网格模板数据只从磁盘读取一次
+
+PredefAssets 统一管理平均顶点、面片、UV与3DMM形状基，
+NumPy数组可选内存映射(mmap)，设备张量按 (名称, 设备, dtype) 缓存，
+渲染与优化循环中不再重复磁盘读取、主机到设备拷贝或float64运算。
+"""
+
+import os
+import threading
+
+import numpy as np
+import torch
+
+
+class PredefAssets:
+    """
+    预定义资源仓库
+    浮点资源按请求的dtype转换（默认float32），面片索引固定为int64
+    """
+
+    FILES = {
+        'mean_verts': 'mean_verts.npy',
+        'faces': 'faces.npy',
+        'uv': 'uv.npy',
+        'core': 'core_1627_300_weight_10.npy',
+    }
+
+    def __init__(self, root='./predef', mmap=False):
+        self.root = root
+        self.mmap = mmap
+        self._arrays = {}
+        self._tensors = {}
+        self._lock = threading.Lock()
+
+    def numpy(self, name):
+        """返回原始NumPy数组（只读取一次）"""
+        with self._lock:
+            if name not in self._arrays:
+                path = os.path.join(self.root, self.FILES[name])
+                self._arrays[name] = np.load(path, mmap_mode='r' if self.mmap else None)
+            return self._arrays[name]
+
+    def tensor(self, name, device='cuda', dtype=torch.float32):
+        """返回驻留在指定设备上的张量（按设备与dtype缓存）"""
+        if name == 'faces':
+            dtype = torch.int64
+        key = (name, str(torch.device(device)), dtype)
+        tensor = self._tensors.get(key)
+        if tensor is None:
+            array = np.ascontiguousarray(self.numpy(name))
+            tensor = torch.from_numpy(array).to(device=device, dtype=dtype)
+            with self._lock:
+                tensor = self._tensors.setdefault(key, tensor)
+        return tensor
+
+    def mean_verts(self, device='cuda', dtype=torch.float32):
+        return self.tensor('mean_verts', device, dtype)
+
+    def faces(self, device='cuda'):
+        return self.tensor('faces', device)
+
+    def uv(self, device='cuda', dtype=torch.float32):
+        return self.tensor('uv', device, dtype)
+
+    def core(self, device='cuda', dtype=torch.float32):
+        return self.tensor('core', device, dtype)
+
+    def uv_grid(self, device='cuda', dtype=torch.float32):
+        """
+        grid_sample用的逐顶点采样网格 [1, 1, V, 2]
+        OBJ的UV原点在左下角，grid_sample的y轴向下，因此翻转v
+        """
+        key = ('uv_grid', str(torch.device(device)), dtype)
+        grid = self._tensors.get(key)
+        if grid is None:
+            uv = self.uv(device, dtype)
+            grid = torch.stack([uv[:, 0] * 2 - 1, 1 - uv[:, 1] * 2], dim=-1)[None, None]
+            with self._lock:
+                grid = self._tensors.setdefault(key, grid)
+        return grid
+
+
+_assets = None
+
+
+def get_assets(root='./predef', mmap=False):
+    """返回进程内共享的预定义资源仓库"""
+    global _assets
+    if _assets is None:
+        _assets = PredefAssets(root, mmap=mmap)
+    return _assets
@@ -0,0 +1,132 @@
+"""
+文本嵌入缓存：按内容寻址的CLIP文本特征磁盘缓存
+
+键为 sha256(模型名 + 原始文本)，每条记录保存为一个 .npy 文件；
+缓存总大小超过上限时按最近使用时间(LRU)淘汰最旧的记录。
+LRU索引在第一次写入（或查询统计）时才扫描磁盘建立，命中读取不需要扫描。
+描述与prompt在请求间大量重复，命中缓存即可跳过CLIP文本编码。
+"""
+
+import hashlib
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+
+
+class TextEmbeddingCache:
+    """
+    CLIP文本特征的磁盘LRU缓存
+    保存原始(未归一化)特征，读取时可选择归一化
+    """
+
+    def __init__(self, cache_dir, max_bytes=256 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = None  # key -> 文件大小，按最近使用排序；首次需要时才建立
+        self._total_bytes = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _ensure_index(self):
+        """从磁盘重建索引（按访问时间排序）；调用方持有锁"""
+        if self._entries is not None:
+            return
+        self._entries = OrderedDict()
+        found = []
+        for root, _, files in os.walk(self.cache_dir):
+            for fname in files:
+                if not fname.endswith('.npy'):
+                    continue
+                st = os.stat(os.path.join(root, fname))
+                found.append((st.st_mtime, fname[:-4], st.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._total_bytes += size
+
+    @staticmethod
+    def make_key(model_name, text):
+        return hashlib.sha256(f'{model_name}\0{text}'.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.npy')
+
+    def get(self, model_name, text, normalize=False):
+        """返回缓存的特征(np.float32)，未命中返回None"""
+        key = self.make_key(model_name, text)
+        path = self._path(key)
+        try:
+            feature = np.load(path)
+        except (FileNotFoundError, ValueError, OSError):
+            with self._lock:
+                self.misses += 1
+                if self._entries is not None and key in self._entries:
+                    self._total_bytes -= self._entries.pop(key)
+            return None
+        try:
+            os.utime(path)  # 更新LRU时间，供索引建立前的命中与其他进程重建索引
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+            if self._entries is not None and key in self._entries:
+                self._entries.move_to_end(key)
+        if normalize:
+            feature = feature / np.linalg.norm(feature, axis=-1, keepdims=True)
+        return feature
+
+    def put(self, model_name, text, feature):
+        """写入一条特征（原子写），必要时触发LRU淘汰"""
+        key = self.make_key(model_name, text)
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, np.ascontiguousarray(feature, dtype=np.float32))
+        os.replace(tmp_path, path)
+        size = os.path.getsize(path)
+        with self._lock:
+            self._ensure_index()
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)
+            self._entries[key] = size
+            self._total_bytes += size
+            self._evict()
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            self._ensure_index()
+            return {
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+_text_cache = None
+
+
+def configure_text_cache(cache_dir, max_bytes=256 * 1024 * 1024):
+    """设置进程内共享的文本嵌入缓存，cache_dir为空时关闭缓存"""
+    global _text_cache
+    _text_cache = TextEmbeddingCache(cache_dir, max_bytes) if cache_dir else None
+    return _text_cache
+
+
+def get_text_cache():
+    """返回进程内共享的文本嵌入缓存（未配置时为None）"""
+    return _text_cache
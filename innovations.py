@@ -9,13 +9,15 @@
 import torch
 import torch.nn as nn
 import numpy as np
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
 import os
 import json
 from datetime import datetime
 
+from assets import get_assets
+from result_writer import count_device_to_host
+from startup_profile import lazy_import
+from torch_utils.ops import grid_sample_gradfix
+
 try:
     from pytorch3d.structures import Meshes
     from pytorch3d.renderer import (
@@ -26,7 +28,8 @@ try:
         MeshRenderer,
         MeshRasterizer,
         SoftPhongShader,
-        TexturesVertex
+        TexturesVertex,
+        TexturesUV
     )
     PYTORCH3D_AVAILABLE = True
 except ImportError as e:
@@ -40,12 +43,16 @@ class MultiViewRenderer:
     支持从多个角度渲染3D人脸，增强生成质量和一致性
     """
     
-    def __init__(self, device="cuda", image_size=512):
+    def __init__(self, device="cuda", image_size=512, texture_mode='vertex'):
         if not PYTORCH3D_AVAILABLE:
             raise ImportError("PyTorch3D is required for MultiViewRenderer. Please install it first.")
+        assert texture_mode in ['vertex', 'uv']
         
         self.device = device
         self.image_size = image_size
+        # 纹理模式：'vertex' 按UV采样顶点颜色；'uv' 使用真正的UV贴图渲染（与导出的OBJ一致）
+        self.texture_mode = texture_mode
+        self.assets = get_assets()
         
         # 定义多个视角：前、左、右、左上、右上
         self.view_angles = {
@@ -56,54 +63,51 @@ class MultiViewRenderer:
             'top_right': {'elev': 15, 'azim': 20},
         }
         
-    def render_multi_view(self, curr_verts, render_img, view_name='front'):
+        # 渲染管线按 (视角列表, 设备, 分辨率) 缓存，避免每步重建相机/光照/光栅化器
+        self._pipelines = {}
+        
+    def _resolve_view(self, view):
+        """视角可以是名称，也可以是 (elev, azim) 元组；未知名称回退到正面"""
+        if isinstance(view, str):
+            view_params = self.view_angles.get(view, self.view_angles['front'])
+            return (float(view_params['elev']), float(view_params['azim']))
+        elev, azim = view
+        return (float(elev), float(azim))
+    
+    def turntable_views(self, num_views, elev=0.0):
         """
-        从指定视角渲染人脸
+        生成环绕一周的密集视角列表，可直接传给 render_views
+        """
+        return [(elev, 360.0 * k / num_views) for k in range(num_views)]
         
-        Args:
-            curr_verts: 当前顶点位置
-            render_img: 纹理图像
-            view_name: 视角名称
+    def get_pipeline(self, views='front', image_size=None):
+        """
+        返回一组视角的渲染器（首次调用时构建并缓存）
         
-        Returns:
-            渲染后的图像
+        Args:
+            views: 单个视角，或视角列表（批量渲染，每个视角对应batch中的一个相机）
+            image_size: 渲染分辨率，None时使用 self.image_size
         """
-        mean_verts = torch.from_numpy(np.load("./predef/mean_verts.npy")).cuda()
-        faces = torch.from_numpy(np.load("./predef/faces.npy")).to(torch.int64).cuda()
-        
-        vertices = (curr_verts + mean_verts).unsqueeze(0)
-        faces_tensor = faces.unsqueeze(0)
-        
-        num_verts = vertices.shape[1]
-        texture_rgb = (render_img[0] + 1) / 2
-        texture_rgb = texture_rgb.permute(1, 2, 0).reshape(-1, 3)
-        
-        if texture_rgb.shape[0] < num_verts:
-            texture_rgb = torch.nn.functional.interpolate(
-                texture_rgb.unsqueeze(0).permute(0, 2, 1),
-                size=num_verts,
-                mode='linear',
-                align_corners=False
-            ).permute(0, 2, 1).squeeze(0)
-        elif texture_rgb.shape[0] > num_verts:
-            indices = torch.linspace(0, texture_rgb.shape[0] - 1, num_verts).long()
-            texture_rgb = texture_rgb[indices]
-        
-        verts_rgb = texture_rgb.unsqueeze(0)
-        textures = TexturesVertex(verts_features=verts_rgb)
-        mesh = Meshes(verts=vertices, faces=faces_tensor, textures=textures)
-        
-        # 根据视角设置相机
-        view_params = self.view_angles.get(view_name, self.view_angles['front'])
+        if isinstance(views, (str, tuple)):
+            views = [views]
+        if image_size is None:
+            image_size = self.image_size
+        angles = tuple(self._resolve_view(view) for view in views)
+        key = (angles, str(self.device), image_size)
+        renderer = self._pipelines.get(key)
+        if renderer is not None:
+            return renderer
+        
+        # 根据视角设置相机（N个视角堆叠为一个batch）
         R, T = look_at_view_transform(
             dist=2.7, 
-            elev=view_params['elev'], 
-            azim=view_params['azim']
+            elev=[angle[0] for angle in angles], 
+            azim=[angle[1] for angle in angles]
         )
         cameras = FoVPerspectiveCameras(device=self.device, R=R, T=T)
         
         raster_settings = RasterizationSettings(
-            image_size=self.image_size,
+            image_size=image_size,
             blur_radius=0.0,
             faces_per_pixel=1,
         )
@@ -121,34 +125,126 @@ class MultiViewRenderer:
                 lights=lights
             )
         )
+        self._pipelines[key] = renderer
+        return renderer
+    
+    def build_mesh(self, curr_verts, render_img):
+        """
+        由顶点偏移和纹理图像构建带顶点颜色的网格
+        curr_verts 为 [V, 3] 时构建单个网格，为 [B, V, 3] 时构建B个网格（与render_img的前B张纹理一一对应）
+        """
+        mean_verts = self.assets.mean_verts(curr_verts.device, curr_verts.dtype)
+        faces = self.assets.faces(curr_verts.device)
+        
+        vertices = curr_verts + mean_verts
+        if vertices.dim() == 2:
+            vertices = vertices.unsqueeze(0)
+        batch_size = vertices.shape[0]
+        render_img = render_img[:batch_size]
+        faces_tensor = faces.unsqueeze(0).expand(batch_size, -1, -1)
+        
+        if self.texture_mode == 'uv':
+            texture_map = (render_img + 1) / 2  # [B, H, W, 3]
+            verts_uvs = self.assets.uv(curr_verts.device, texture_map.dtype).unsqueeze(0).expand(batch_size, -1, -1)
+            textures = TexturesUV(maps=texture_map, faces_uvs=faces_tensor, verts_uvs=verts_uvs)
+        else:
+            textures = TexturesVertex(verts_features=self.sample_vertex_colors(render_img))
+        return Meshes(verts=vertices, faces=faces_tensor, textures=textures)
+    
+    def sample_vertex_colors(self, render_img):
+        """
+        按 predef/uv.npy 的逐顶点UV从纹理图中双线性采样顶点颜色
+        
+        Args:
+            render_img: 纹理图像 [B, H, W, 3]，取值范围[-1, 1]
+        
+        Returns:
+            顶点颜色 [B, V, 3]
+        """
+        texture = ((render_img + 1) / 2).permute(0, 3, 1, 2)  # NHWC -> NCHW
+        grid = self.assets.uv_grid(texture.device, texture.dtype)
+        grid = grid.expand(texture.shape[0], -1, -1, -1)
+        colors = grid_sample_gradfix.grid_sample(texture, grid)  # [B, 3, 1, V]
+        return colors[:, :, 0, :].permute(0, 2, 1)
+        
+    def render_multi_view(self, curr_verts, render_img, view_name='front', image_size=None):
+        """
+        从指定视角渲染人脸
+        
+        Args:
+            curr_verts: 当前顶点位置
+            render_img: 纹理图像
+            view_name: 视角名称
+            image_size: 渲染分辨率，None时使用 self.image_size
+        
+        Returns:
+            渲染后的图像
+        """
+        mesh = self.build_mesh(curr_verts, render_img)
+        renderer = self.get_pipeline(view_name, image_size)
         
         images = renderer(mesh)
         img_pred = images[0, ..., :3]
         
         return img_pred
     
-    def compute_multi_view_consistency_loss(self, curr_verts, render_img):
+    def render_batch(self, curr_verts, render_img, view_name='front', image_size=None):
+        """
+        同一视角下一次渲染B个不同的人脸
+        
+        Args:
+            curr_verts: 顶点位置 [B, V, 3]
+            render_img: 纹理图像 [B, H, W, 3]
+            view_name: 视角名称
+            image_size: 渲染分辨率，None时使用 self.image_size
+        
+        Returns:
+            渲染图像 [B, H, W, 3]
+        """
+        mesh = self.build_mesh(curr_verts, render_img)
+        renderer = self.get_pipeline(view_name, image_size)
+        
+        images = renderer(mesh)
+        return images[..., :3]
+    
+    def render_views(self, curr_verts, render_img, views, image_size=None):
+        """
+        一次光栅化+着色同时渲染多个视角
+        网格扩展为N份，与N个相机组成一个batch
+        
+        Args:
+            curr_verts: 当前顶点位置
+            render_img: 纹理图像
+            views: 视角列表（名称或 (elev, azim) 元组）
+            image_size: 渲染分辨率，None时使用 self.image_size
+        
+        Returns:
+            渲染图像 [N, H, W, 3]
+        """
+        mesh = self.build_mesh(curr_verts, render_img).extend(len(views))
+        renderer = self.get_pipeline(list(views), image_size)
+        
+        images = renderer(mesh)
+        return images[..., :3]
+    
+    def compute_multi_view_consistency_loss(self, curr_verts, render_img, image_size=None):
         """
         计算多视角一致性损失
         通过比较不同视角渲染结果的特征相似性来确保3D一致性
         """
         views = ['front', 'left', 'right']
-        rendered_views = []
-        
-        for view_name in views:
-            img = self.render_multi_view(curr_verts, render_img, view_name)
-            rendered_views.append(img)
+        rendered_views = self.render_views(curr_verts, render_img, views, image_size)
         
         # 计算视角间的特征一致性
         consistency_loss = 0.0
-        for i in range(len(rendered_views)):
-            for j in range(i + 1, len(rendered_views)):
+        for i in range(len(views)):
+            for j in range(i + 1, len(views)):
                 # 使用L2距离衡量一致性（在特征空间）
                 view_i = rendered_views[i].mean(dim=[0, 1])  # 平均特征
                 view_j = rendered_views[j].mean(dim=[0, 1])
                 consistency_loss += torch.nn.functional.mse_loss(view_i, view_j)
         
-        return consistency_loss / len(rendered_views)
+        return consistency_loss / len(views)
 
 
 class ProgressiveOptimizer:
@@ -158,12 +254,16 @@ class ProgressiveOptimizer:
     """
     
     def __init__(self, total_steps, initial_lr_latent=0.008, initial_lr_param=0.003,
-                 initial_lambda_latent=0.0003, initial_lambda_param=3.0):
+                 initial_lambda_latent=0.0003, initial_lambda_param=3.0,
+                 render_sizes=(224, 224, 512)):
         self.total_steps = total_steps
         self.initial_lr_latent = initial_lr_latent
         self.initial_lr_param = initial_lr_param
         self.initial_lambda_latent = initial_lambda_latent
         self.initial_lambda_param = initial_lambda_param
+        # 每个阶段的渲染分辨率：CLIP只看224x224，前两个阶段不必按全分辨率光栅化
+        self.render_sizes = tuple(render_sizes)
+        assert len(self.render_sizes) == 3
         
         # 定义三个阶段
         self.stage1_end = int(total_steps * 0.4)  # 前40%：重点优化纹理
@@ -172,7 +272,7 @@ class ProgressiveOptimizer:
         
     def get_current_params(self, step):
         """
-        根据当前步数返回学习率和正则化权重
+        根据当前步数返回学习率、正则化权重与渲染分辨率
         """
         if step < self.stage1_end:
             # 阶段1：重点优化纹理
@@ -180,6 +280,7 @@ class ProgressiveOptimizer:
             lr_param = self.initial_lr_param * 0.5     # 降低形状学习率
             lambda_latent = self.initial_lambda_latent * 0.5  # 降低纹理正则化
             lambda_param = self.initial_lambda_param * 1.5    # 提高形状正则化
+            render_size = self.render_sizes[0]
             stage = "Stage 1: Texture Focus"
             
         elif step < self.stage2_end:
@@ -188,6 +289,7 @@ class ProgressiveOptimizer:
             lr_param = self.initial_lr_param * 1.5
             lambda_latent = self.initial_lambda_latent * 1.5
             lambda_param = self.initial_lambda_param * 0.5
+            render_size = self.render_sizes[1]
             stage = "Stage 2: Shape Focus"
             
         else:
@@ -199,6 +301,7 @@ class ProgressiveOptimizer:
             lr_param = self.initial_lr_param * decay
             lambda_latent = self.initial_lambda_latent
             lambda_param = self.initial_lambda_param
+            render_size = self.render_sizes[2]
             stage = "Stage 3: Joint Refinement"
         
         return {
@@ -206,6 +309,7 @@ class ProgressiveOptimizer:
             'lr_param': lr_param,
             'lambda_latent': lambda_latent,
             'lambda_param': lambda_param,
+            'render_size': render_size,
             'stage': stage
         }
 
@@ -214,10 +318,16 @@ class QualityEvaluator:
     """
     创新点3：质量评估器
     评估每次迭代的结果质量，自动保存最佳结果
+    
+    record() 不做设备同步：指标写入设备上预分配的缓冲区，最佳状态以设备端快照保存；
+    每 flush_interval 步（以及结束时）flush() 一次性拷回主机、追加到history并写出 best_model.pth
     """
     
-    def __init__(self, save_dir):
+    METRICS = ['clip_loss', 'l2_latent', 'l2_param', 'total_loss', 'quality_score']
+    
+    def __init__(self, save_dir, flush_interval=1):
         self.save_dir = save_dir
+        self.flush_interval = max(1, flush_interval)
         self.best_score = float('inf')
         self.best_iteration = 0
         self.history = {
@@ -228,62 +338,143 @@ class QualityEvaluator:
             'total_loss': [],
             'quality_score': []
         }
+        # 优化结束原因（由早停策略设置）
+        self.stop_reason = 'completed all steps'
+        self.stop_iteration = None
+        
+        # 设备端缓冲区与最佳状态快照（首次record时按输入所在设备分配）
+        self._buffer = None
+        self._pending_iterations = []
+        self._device_best_score = None
+        self._best_snapshot = None
+        self._best_snapshot_dirty = False
         
         # 创建保存目录
         os.makedirs(save_dir, exist_ok=True)
-        
-    def evaluate(self, iteration, clip_loss, l2_latent, l2_param, total_loss):
+    
+    def record(self, iteration, clip_loss, l2_latent, l2_param, total_loss, latent=None, param=None):
         """
-        评估当前迭代的质量
+        记录一次迭代（不同步）
         
         质量分数综合考虑：
         - CLIP损失（越小越好）
         - L2正则化（过大或过小都不好，需要平衡）
         - 总损失
+        
+        传入 latent/param 时，分数更优的迭代会在设备上覆盖最佳状态快照
         """
         # 归一化各个指标
         clip_weight = 0.6
         regularization_weight = 0.4
         
-        # CLIP损失是主要指标
-        clip_score = clip_loss.item() * clip_weight
-        
-        # 正则化分数：希望在合理范围内（不要过度偏离初始值）
-        reg_score = (l2_latent.item() + l2_param.item()) * regularization_weight
+        device = clip_loss.device if torch.is_tensor(clip_loss) else torch.device('cpu')
+        values = [torch.as_tensor(value, device=device).detach().float() for value in (clip_loss, l2_latent, l2_param, total_loss)]
         
+        # CLIP损失是主要指标；正则化分数：希望在合理范围内（不要过度偏离初始值）
         # 综合质量分数（越小越好）
-        quality_score = clip_score + reg_score * 0.1
-        
-        # 记录历史
-        self.history['iteration'].append(iteration)
-        self.history['clip_loss'].append(clip_loss.item())
-        self.history['l2_latent'].append(l2_latent.item())
-        self.history['l2_param'].append(l2_param.item())
-        self.history['total_loss'].append(total_loss.item())
-        self.history['quality_score'].append(quality_score)
-        
-        # 判断是否是最佳结果
-        is_best = quality_score < self.best_score
-        if is_best:
-            self.best_score = quality_score
-            self.best_iteration = iteration
-        
-        return is_best, quality_score
+        quality_score = values[0] * clip_weight + (values[1] + values[2]) * regularization_weight * 0.1
+        
+        if self._buffer is None or self._buffer.device != device:
+            self._buffer = torch.empty(self.flush_interval, len(self.METRICS), device=device)
+        self._buffer[len(self._pending_iterations)] = torch.stack(values + [quality_score])
+        self._pending_iterations.append(iteration)
+        
+        if latent is not None and param is not None:
+            if self._device_best_score is None:
+                self._device_best_score = torch.tensor(self.best_score, device=device)
+            improved = quality_score < self._device_best_score
+            self._device_best_score = torch.where(improved, quality_score, self._device_best_score)
+            if self._best_snapshot is None:
+                self._best_snapshot = {'latent': latent.detach().clone(), 'param': param.detach().clone()}
+            else:
+                for key, value in (('latent', latent), ('param', param)):
+                    snapshot = self._best_snapshot[key].to(value.device)
+                    self._best_snapshot[key] = torch.where(improved, value.detach(), snapshot)
+            self._best_snapshot_dirty = True
+        
+        if len(self._pending_iterations) == self.flush_interval:
+            self.flush()
+        return quality_score
     
-    def save_best_state(self, latent, param, iteration):
-        """保存最佳状态"""
-        best_state = {
-            'latent': latent.detach().cpu(),
-            'param': param.detach().cpu(),
-            'iteration': iteration,
+    def flush(self):
+        """把缓冲区中的指标拷回主机（一次同步），更新最佳分数并写出最佳状态"""
+        if self._pending_iterations:
+            if self._buffer.is_cuda:
+                count_device_to_host()
+            rows = self._buffer[:len(self._pending_iterations)].cpu().tolist()
+            for iteration, row in zip(self._pending_iterations, rows):
+                self.history['iteration'].append(iteration)
+                for name, value in zip(self.METRICS, row):
+                    self.history[name].append(value)
+                # 判断是否是最佳结果
+                if row[-1] < self.best_score:
+                    self.best_score = row[-1]
+                    self.best_iteration = iteration
+            self._pending_iterations = []
+        
+        if self._best_snapshot_dirty:
+            torch.save(self.best_state(), os.path.join(self.save_dir, 'best_model.pth'))
+            self._best_snapshot_dirty = False
+    
+    def evaluate(self, iteration, clip_loss, l2_latent, l2_param, total_loss):
+        """
+        同步评估当前迭代：记录并立即flush，返回 (是否最佳, 质量分数)
+        """
+        self.record(iteration, clip_loss, l2_latent, l2_param, total_loss)
+        self.flush()
+        return self.best_iteration == iteration, self.history['quality_score'][-1]
+    
+    def best_state(self):
+        """返回主机端的最佳状态（latent/param/迭代/分数）"""
+        if self._best_snapshot is None:
+            return None
+        return {
+            'latent': self._best_snapshot['latent'].cpu(),
+            'param': self._best_snapshot['param'].cpu(),
+            'iteration': self.best_iteration,
             'score': self.best_score
         }
-        torch.save(best_state, os.path.join(self.save_dir, 'best_model.pth'))
+    
+    def state_dict(self):
+        """返回可序列化的评估器状态（用于断点续跑，包含最佳状态快照）"""
+        self.flush()
+        return {
+            'best_score': self.best_score,
+            'best_iteration': self.best_iteration,
+            'history': self.history,
+            'stop_reason': self.stop_reason,
+            'stop_iteration': self.stop_iteration,
+            'best_state': self.best_state(),
+        }
+    
+    def load_state_dict(self, state):
+        """从 state_dict() 的结果恢复评估器状态"""
+        self.best_score = state['best_score']
+        self.best_iteration = state['best_iteration']
+        self.history = {key: list(values) for key, values in state['history'].items()}
+        self.stop_reason = state['stop_reason']
+        self.stop_iteration = state['stop_iteration']
+        self._pending_iterations = []
+        self._device_best_score = None
+        best_state = state.get('best_state')
+        self._best_snapshot = None if best_state is None else {'latent': best_state['latent'], 'param': best_state['param']}
+        self._best_snapshot_dirty = False
+    
+    def save_best_state(self, latent, param, iteration):
+        """用给定状态覆盖最佳状态快照（下一次flush时写出）"""
+        self._best_snapshot = {'latent': latent.detach().clone(), 'param': param.detach().clone()}
+        self._best_snapshot_dirty = True
     
     def generate_report(self):
         """
         生成优化过程的可视化报告
         """
+        self.flush()
+        # matplotlib只在生成报告时才需要，不在模块加载时导入
+        matplotlib = lazy_import('matplotlib')
+        matplotlib.use('Agg')
+        plt = lazy_import('matplotlib.pyplot')
+        
         fig, axes = plt.subplots(2, 2, figsize=(15, 10))
         
         # 绘制CLIP损失曲线
@@ -341,6 +532,8 @@ class QualityEvaluator:
                 'l2_param': self.history['l2_param'][-1],
                 'total_loss': self.history['total_loss'][-1]
             },
+            'stop_reason': self.stop_reason,
+            'stop_iteration': self.stop_iteration,
             'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         }
         
@@ -348,3 +541,62 @@ class QualityEvaluator:
             json.dump(report, f, indent=4)
         
         return report
+
+
+class EarlyStopping:
+    """
+    基于质量评估历史的早停策略
+    质量分数在 patience 步内没有下降超过 min_delta 时停止（至少运行 min_steps 步）
+    """
+    
+    def __init__(self, patience=20, min_delta=1e-4, min_steps=30):
+        self.patience = patience
+        self.min_delta = min_delta
+        self.min_steps = min_steps
+        self.best_score = float('inf')
+        self.best_iteration = 0
+        self.stop_reason = None
+        # 已检查过的历史条数（评估器按间隔flush时一次会追加多条）
+        self.num_seen = 0
+        
+    def state_dict(self):
+        return {
+            'best_score': self.best_score,
+            'best_iteration': self.best_iteration,
+            'stop_reason': self.stop_reason,
+            'num_seen': self.num_seen,
+        }
+    
+    def load_state_dict(self, state):
+        self.best_score = state['best_score']
+        self.best_iteration = state['best_iteration']
+        self.stop_reason = state['stop_reason']
+        self.num_seen = state.get('num_seen', 0)
+        
+    def step(self, evaluator):
+        """
+        检查评估器自上次调用以来flush的质量分数，返回是否应当停止
+        """
+        scores = evaluator.history['quality_score']
+        while self.num_seen < len(scores):
+            iteration = evaluator.history['iteration'][self.num_seen]
+            score = scores[self.num_seen]
+            self.num_seen += 1
+            
+            if score < self.best_score - self.min_delta:
+                self.best_score = score
+                self.best_iteration = iteration
+                continue
+            
+            if self.num_seen < self.min_steps:
+                continue
+            
+            if iteration - self.best_iteration >= self.patience:
+                self.stop_reason = (
+                    f"early stopped: no improvement > {self.min_delta:g} "
+                    f"for {iteration - self.best_iteration} steps (best at {self.best_iteration})"
+                )
+                evaluator.stop_reason = self.stop_reason
+                evaluator.stop_iteration = iteration
+                return True
+        return False
@@ -1,178 +1,283 @@
-import PIL.Image
-import trimesh
+from startup_profile import lazy_import, mark_core_imports, mark_first_work, report_startup
+import contextlib
+import copy
+import os
+import time
 import options
 import torch
 import numpy as np
-from model import Classify_Network,Shape_Network,Texture_Network
-import os
-import clip
-import dnnlib
-import cv2
-import torchvision
-from torchvision.transforms.transforms import ToPILImage
-import legacy
+from model import Shape_Network
 from torch import optim
-from tqdm import tqdm
-from pytorch3d.structures import Meshes
-from pytorch3d.renderer import (
-    look_at_view_transform,
-    FoVPerspectiveCameras, 
-    PointLights,
-    RasterizationSettings, 
-    MeshRenderer, 
-    MeshRasterizer,
-    SoftPhongShader,
-    TexturesVertex
-)
-from innovations import MultiViewRenderer, ProgressiveOptimizer, QualityEvaluator
-
-
-#to replace trimesh.load
-def load_ori_mesh(fn):
-    return trimesh.load(fn,resolver=None,split_object=False,group_material=False,skip_materials=False,maintain_order=True,process=False)
+from model_registry import get_registry
+from assets import get_assets
+from embedding_cache import configure_text_cache, get_text_cache
+from result_writer import AsyncResultWriter, count_device_to_host, device_to_host_count
+from mesh_io import export_compact, get_template
+
+# 重量级依赖（pytorch3d/clip/cv2/torchvision/tqdm/innovations等）推迟到用到它们的阶段再导入，
+# 只做具体合成的进程不为渲染、绘图或写JPEG付出导入开销
+mark_core_imports()
+
+
+CLIP_MODEL_NAME = "ViT-B/32"
+
+
+# CLIP图像编码器训练时使用的归一化参数
+CLIP_MEAN = (0.48145466, 0.4578275, 0.40821073)
+CLIP_STD = (0.26862954, 0.26130258, 0.27577711)
+
+
+class CLIPPreprocess(torch.nn.Module):
+    """
+    可微的CLIP图像预处理：[N, 3, H, W]、取值[0, 1]的图像缩放到编码器分辨率并做mean/std归一化
+    缩放为面积插值（按像素覆盖比例加权的盒式滤波，自带抗锯齿），分解为两次小矩阵乘法，
+    结果与原先的7倍上采样+平均池化一致，但不产生49倍大小的中间张量
+    """
+
+    def __init__(self, size=224):
+        super(CLIPPreprocess, self).__init__()
+        self.size = size
+        self._constants = {}
+
+    @staticmethod
+    def area_weights(in_size, out_size):
+        # 第o个输出像素覆盖源区间[o*scale, (o+1)*scale)，权重为与每个源像素的重叠长度
+        scale = in_size / out_size
+        lo = torch.arange(out_size, dtype=torch.float64)[:, None] * scale
+        src = torch.arange(in_size, dtype=torch.float64)[None, :]
+        overlap = (torch.min(lo + scale, src + 1) - torch.max(lo, src)).clamp(min=0)
+        return overlap / scale
+
+    def _constant(self, name, device, dtype, build):
+        key = (name, str(device), dtype)
+        if key not in self._constants:
+            self._constants[key] = build().to(device=device, dtype=dtype)
+        return self._constants[key]
+
+    def forward(self, image):
+        device, dtype = image.device, image.dtype
+        height, width = image.shape[-2:]
+        if height != self.size:
+            image = torch.matmul(self._constant(('rows', height), device, dtype, lambda: self.area_weights(height, self.size)), image)
+        if width != self.size:
+            image = torch.matmul(image, self._constant(('cols', width), device, dtype, lambda: self.area_weights(width, self.size).t()))
+        mean = self._constant('mean', device, dtype, lambda: torch.tensor(CLIP_MEAN).view(1, 3, 1, 1))
+        std = self._constant('std', device, dtype, lambda: torch.tensor(CLIP_STD).view(1, 3, 1, 1))
+        return (image - mean) / std
 
 
 class CLIPLoss(torch.nn.Module):
-    def __init__(self, stylegan_size=512):
+    def __init__(self, stylegan_size=512, prompt=None, device="cuda"):
         super(CLIPLoss, self).__init__()
-        self.model, self.preprocess = clip.load("ViT-B/32", device="cuda")
-        self.upsample = torch.nn.Upsample(scale_factor=7)
-        self.avg_pool = torch.nn.AvgPool2d(kernel_size=stylegan_size // 32)
-
-    def forward(self, image, text):
-        image_upsam = self.upsample(image)
-        image = self.avg_pool(image_upsam)
-        similarity = 1 - self.model(image, text)[0] / 100
+        self.device = device
+        self.model, self.preprocess = get_registry().clip(CLIP_MODEL_NAME, device=device)
+        self.image_preprocess = CLIPPreprocess(self.model.visual.input_resolution)
+        self.text_features = None
+        if prompt is not None:
+            self.set_prompt(prompt)
+
+    def set_prompt(self, prompt):
+        # prompt在优化过程中不变：只编码并归一化一次，之后每步只跑图像分支
+        self.text_features = encode_text(prompt, normalize=True, device=self.device)
+
+    def forward(self, image, text=None, model=None):
+        # image: [N, 3, H, W]，取值[0, 1]（渲染结果）；model 可替换CLIP实例（例如fp32参考副本）
+        if model is None:
+            model = self.model
+        image = self.image_preprocess(image)
+        if text is not None:
+            similarity = 1 - model(image, text)[0] / 100
+            return similarity
+        image_features = model.encode_image(image).float()
+        image_features = image_features / image_features.norm(dim=-1, keepdim=True)
+        logit_scale = model.logit_scale.exp().float()
+        # 第k张图像与第k条prompt配对（只有一条prompt时广播到所有图像）
+        similarity = 1 - logit_scale * (image_features * self.text_features).sum(dim=-1) / 100
         return similarity
 
 class generation(torch.nn.Module):
     def __init__(self):
         super(generation, self).__init__()
 
-def encode_text(text):
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    clip_model, preprocess = clip.load("ViT-B/32", device=device)
-    tokens = clip.tokenize(text,truncate=True).to(device)
-    with torch.no_grad():
-        text_features = clip_model.encode_text(tokens).float()
+def encode_text(text, normalize=False, device=None):
+    # 共享的CLIP实例 + 磁盘文本嵌入缓存，命中缓存的文本不再经过CLIP前向
+    if device is None:
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    texts = [text] if isinstance(text, str) else list(text)
+    cache = get_text_cache()
+
+    features = [cache.get(CLIP_MODEL_NAME, t) if cache is not None else None for t in texts]
+    missing = [idx for idx, feature in enumerate(features) if feature is None]
+    if missing:
+        clip = lazy_import('clip')
+        clip_model, preprocess = get_registry().clip(CLIP_MODEL_NAME, device=device)
+        tokens = clip.tokenize([texts[idx] for idx in missing],truncate=True).to(device)
+        with torch.no_grad():
+            encoded = clip_model.encode_text(tokens).float().cpu().numpy()
+        for idx, feature in zip(missing, encoded):
+            features[idx] = feature
+            if cache is not None:
+                cache.put(CLIP_MODEL_NAME, texts[idx], feature)
+
+    text_features = torch.from_numpy(np.stack(features)).to(device)
+    if normalize:
+        text_features = text_features / text_features.norm(dim=-1, keepdim=True)
     return text_features
 
 def gen_onehot(opt,text):
+    # text可以是单条描述或描述列表，所有输出都带batch维
+    device = torch.device(opt.device)
+    classify_model = get_registry().classifier(opt.classfier_path, device=device)
 
-    classify_model = Classify_Network.MLP()
-    state = torch.load(opt.classfier_path)
-    classify_model.load_state_dict(state['MLP'])
-    classify_model.cuda()
-    classify_model.eval()
+    text_features = encode_text(text, device=device)
+    batch_size = text_features.shape[0]
 
-    text_features = encode_text(text)
-
-    onehot_pred = classify_model(text_features).reshape(24,8)
-    shape_onehot = onehot_pred[:16,:]
-    shape_onehot = ((shape_onehot==shape_onehot.max(dim=-1,keepdim=True)[0])*1).reshape(1,-1)
-    texture_onehot = torch.cat((onehot_pred[:3,:],onehot_pred[16:,:]),dim=0)
-    texture_onehot = ((texture_onehot==texture_onehot.max(dim=-1,keepdim=True)[0])*1).reshape(1,-1)
-    all_pred = torch.cat((shape_onehot.reshape(-1,8),texture_onehot.reshape(-1,8)[3:,:]),dim=0)
+    with torch.no_grad():
+        onehot_pred = classify_model(text_features).reshape(batch_size,24,8)
+    mark_first_work()
+    shape_onehot = onehot_pred[:,:16,:]
+    shape_onehot = ((shape_onehot==shape_onehot.max(dim=-1,keepdim=True)[0])*1).reshape(batch_size,-1)
+    texture_onehot = torch.cat((onehot_pred[:,:3,:],onehot_pred[:,16:,:]),dim=1)
+    texture_onehot = ((texture_onehot==texture_onehot.max(dim=-1,keepdim=True)[0])*1).reshape(batch_size,-1)
+    all_pred = torch.cat((shape_onehot.reshape(batch_size,-1,8),texture_onehot.reshape(batch_size,-1,8)[:,3:,:]),dim=1)
 
     return all_pred,shape_onehot,texture_onehot
 
 def gen_shape(shape_label,opt):
 
-    device = torch.device("cuda:0")
-    model = Shape_Network.MLP()
-    state = torch.load(opt.ShapeNet_path)
-    model.load_state_dict(state['MLP'])
-    model.to(device)
-    model.eval()
-    mean_mesh = load_ori_mesh("./predef/mean_face_3DMM_300.obj")
+    device = torch.device(opt.device)
+    model = get_registry().shape_net(opt.ShapeNet_path, device=device)
+    template = get_template("./predef/mean_face_3DMM_300.obj")
     # mean_verts = np.load("./predef/mean_verts.npy")
-    core = np.load("./predef/core_1627_300_weight_10.npy")
-    pred_param = model(shape_label).detach().cpu().numpy()
-    pred_verts = np.matmul(pred_param,core).reshape(-1,3)
-    curr_mesh = mean_mesh.copy()
-    curr_mesh.vertices = mean_mesh.vertices + pred_verts
+    decoder = get_shape_decoder(opt,device)
+    with torch.no_grad():
+        pred_param = model(shape_label)
+        pred_verts = decoder(pred_param).cpu().numpy()
+    meshes = []
+    for verts in pred_verts:
+        curr_mesh = template.make_mesh(template.vertices + verts)
+        meshes.append(curr_mesh)
 
     # curr_mesh.export("./result/0_1.obj");
 
-    return curr_mesh,torch.from_numpy(pred_param).cuda()
+    return meshes,pred_param
 
 def gen_texture(opt,texture_label):
-    trans_pil = ToPILImage()
-    device = torch.device('cuda')
-    with dnnlib.util.open_url(opt.TextureNet_path) as f:
-        G = legacy.load_network_pkl(f)['G_ema'].to(device) # type: ignore
+    device = torch.device(opt.device)
+    G = get_registry().texture_net(opt.TextureNet_path, device=device)
     Mapping = G.mapping
     Synthesis = G.synthesis
-    z = torch.randn(1, G.z_dim).to(device)
-    ws = Mapping(z, texture_label)
-    img = Synthesis(ws, noise_mode='const')
-    texture = torch.clip((img[0]+1)/2,0,1)
+    z = torch.randn(texture_label.shape[0], G.z_dim).to(device)
+    with torch.no_grad():
+        ws = Mapping(z, texture_label)
+        img = Synthesis(ws, noise_mode='const')
+    texture = torch.clip((img+1)/2,0,1)
     # texture = texture.squeeze(0)  # 压缩一维
-    texture = trans_pil(texture)
+    textures = [to_pil_image(tex) for tex in texture]
     # texture.save("./result/material_0.png")
 
-    return texture,ws,Synthesis
-
-def concrete_synthesis(opt,shape_label,texture_label):
+    return textures,ws,Synthesis
 
-    mesh,pred_param = gen_shape(shape_label,opt)
-    texture,ws,Synthesis = gen_texture(opt,texture_label=texture_label)
+def export_result(opt,mesh,save_dir,stem):
+    # obj：完整的OBJ+MTL+纹理PNG；npz：共享模板拓扑的紧凑二进制格式（见mesh_io.py）
+    if opt.export_format == 'npz':
+        export_compact(os.path.join(save_dir,stem+".npz"),mesh.vertices,mesh.visual.material.image,
+                       mesh.faces,mesh.visual.uv,template_root=opt.result_dir,quantize=opt.quantize_verts)
+    else:
+        mesh.export(os.path.join(save_dir,stem+".obj"));
 
-    mesh.visual.material.image = texture
+def concrete_synthesis(opt,shape_label,texture_label,names=None):
+    # names不为空时（批处理模式），每个结果保存到 result_dir/name/<names[k]>/ 子目录
+    meshes,pred_param = gen_shape(shape_label,opt)
+    textures,ws,Synthesis = gen_texture(opt,texture_label=texture_label)
 
     save_path = os.path.join(opt.result_dir,opt.name)
-    if not os.path.exists(save_path):
-        os.mkdir(save_path)
-    obj_save_path = os.path.join(save_path,"result_concrete.obj")
-    mesh.export(obj_save_path);
+    os.makedirs(save_path, exist_ok=True)
+    for idx,(mesh,texture) in enumerate(zip(meshes,textures)):
+        mesh.visual.material.image = texture
+        mesh_dir = save_path if names is None else os.path.join(save_path,names[idx])
+        os.makedirs(mesh_dir, exist_ok=True)
+        export_result(opt,mesh,mesh_dir,"result_concrete")
 
     return ws,pred_param,Synthesis
 
 
+def batch_concrete_synthesis(opt):
+    # 批处理模式：从文件读取N条描述（每行一条），按micro-batch依次通过各阶段
+    with open(opt.descriptions_file, encoding='utf-8') as f:
+        descriptions = [line.strip() for line in f if line.strip()]
+
+    start = time.perf_counter()
+    for begin in range(0, len(descriptions), opt.batch_size):
+        chunk = descriptions[begin:begin+opt.batch_size]
+        names = [str(begin+k).zfill(5) for k in range(len(chunk))]
+        all_label,shape_label,texture_label = gen_onehot(opt,text=chunk)
+        concrete_synthesis(opt,shape_label,texture_label,names=names)
+        for name,text in zip(names,chunk):
+            with open(os.path.join(opt.result_dir,opt.name,name,"description.txt"),'w',encoding='utf-8') as f:
+                f.write(text + "\n")
+    elapsed = time.perf_counter() - start
+
+    print(f"生成 {len(descriptions)} 个人脸，耗时 {elapsed:.2f}s（{len(descriptions)/elapsed:.2f} faces/s）")
+
+
+_CORE_DTYPES = {'fp32': torch.float32, 'fp16': torch.float16, 'bf16': torch.bfloat16}
+
+_core_dtype_fallback = {'reported': False}
+
+
+def resolve_core_dtype(opt, device):
+    # CPU上没有fp16/bf16矩阵乘（README中的torch 1.7.1），形状基回退到fp32；提示只打印一次
+    core_dtype = _CORE_DTYPES[opt.core_dtype]
+    if core_dtype != torch.float32 and device.type != 'cuda':
+        if not _core_dtype_fallback['reported']:
+            print(f"CPU不支持{opt.core_dtype}形状基，改用fp32")
+            _core_dtype_fallback['reported'] = True
+        core_dtype = torch.float32
+    return core_dtype
+
+
+def get_shape_decoder(opt,device):
+    # 形状基通过PredefAssets按设备/精度常驻，解码器只引用该张量
+    core = get_assets().core(device, resolve_core_dtype(opt, device))
+    return Shape_Network.ShapeDecoder(core)
+
+
 def diff_render(render_img, curr_verts):
-    device = "cuda"
-    mean_verts = torch.from_numpy(np.load("./predef/mean_verts.npy")).cuda()
-    faces = torch.from_numpy(np.load("./predef/faces.npy")).to(torch.int64).cuda()
+    grid_sample_gradfix = lazy_import('torch_utils.ops.grid_sample_gradfix')
+    structures = lazy_import('pytorch3d.structures')
+    renderer_lib = lazy_import('pytorch3d.renderer')
+    device = curr_verts.device
+    assets = get_assets()
+    mean_verts = assets.mean_verts(curr_verts.device, curr_verts.dtype)
+    faces = assets.faces(curr_verts.device)
     
     vertices = (curr_verts + mean_verts).unsqueeze(0)
     faces_tensor = faces.unsqueeze(0)
     
-    num_verts = vertices.shape[1]
-    texture_rgb = (render_img[0] + 1) / 2
-    texture_rgb = texture_rgb.permute(1, 2, 0).reshape(-1, 3)
-    
-    if texture_rgb.shape[0] < num_verts:
-        texture_rgb = torch.nn.functional.interpolate(
-            texture_rgb.unsqueeze(0).permute(0, 2, 1),
-            size=num_verts,
-            mode='linear',
-            align_corners=False
-        ).permute(0, 2, 1).squeeze(0)
-    elif texture_rgb.shape[0] > num_verts:
-        indices = torch.linspace(0, texture_rgb.shape[0] - 1, num_verts).long()
-        texture_rgb = texture_rgb[indices]
-    
-    verts_rgb = texture_rgb.unsqueeze(0)
-    textures = TexturesVertex(verts_features=verts_rgb)
-    mesh = Meshes(verts=vertices, faces=faces_tensor, textures=textures)
+    texture = ((render_img[:1] + 1) / 2).permute(0, 3, 1, 2)
+    grid = assets.uv_grid(texture.device, texture.dtype)
+    verts_rgb = grid_sample_gradfix.grid_sample(texture, grid)[:, :, 0, :].permute(0, 2, 1)
+    textures = renderer_lib.TexturesVertex(verts_features=verts_rgb)
+    mesh = structures.Meshes(verts=vertices, faces=faces_tensor, textures=textures)
     
-    R, T = look_at_view_transform(dist=2.7, elev=0, azim=0)
-    cameras = FoVPerspectiveCameras(device=device, R=R, T=T)
+    R, T = renderer_lib.look_at_view_transform(dist=2.7, elev=0, azim=0)
+    cameras = renderer_lib.FoVPerspectiveCameras(device=device, R=R, T=T)
     
-    raster_settings = RasterizationSettings(
+    raster_settings = renderer_lib.RasterizationSettings(
         image_size=512,
         blur_radius=0.0,
         faces_per_pixel=1,
     )
     
-    lights = PointLights(device=device, location=[[0.0, 0.0, 3.0]])
+    lights = renderer_lib.PointLights(device=device, location=[[0.0, 0.0, 3.0]])
     
-    renderer = MeshRenderer(
-        rasterizer=MeshRasterizer(
+    renderer = renderer_lib.MeshRenderer(
+        rasterizer=renderer_lib.MeshRasterizer(
             cameras=cameras,
             raster_settings=raster_settings
         ),
-        shader=SoftPhongShader(
+        shader=renderer_lib.SoftPhongShader(
             device=device,
             cameras=cameras,
             lights=lights
@@ -185,165 +290,499 @@ def diff_render(render_img, curr_verts):
     return img_pred
 
 
+def resolve_amp_dtype(opt, device):
+    # torch.autocast(device_type=...) 需要 torch>=1.10；更早的版本（README中的1.7.1）只有CUDA上的fp16 autocast
+    amp_dtype = {'fp16': torch.float16, 'bf16': torch.bfloat16}.get(opt.amp)
+    if amp_dtype == torch.float16 and device.type != 'cuda':
+        print("CPU不支持fp16 autocast，改用bf16")
+        amp_dtype = torch.bfloat16
+    if amp_dtype is not None and not hasattr(torch, 'autocast') and (device.type != 'cuda' or amp_dtype != torch.float16):
+        print(f"torch {torch.__version__} 只支持CUDA上的fp16 autocast，关闭混合精度")
+        amp_dtype = None
+    return amp_dtype
+
+
+def amp_autocast(device, amp_dtype):
+    if amp_dtype is None:
+        return contextlib.nullcontext()
+    if hasattr(torch, 'autocast'):
+        return torch.autocast(device_type=device.type, dtype=amp_dtype)
+    return torch.cuda.amp.autocast()
+
+
+def check_amp_accuracy(clip_loss, img_chw, c_loss_amp, tolerance=1e-2):
+    # 参考值用CLIP的fp32副本在autocast之外计算：CUDA上clip.load得到的权重本身就是fp16，
+    # encode_image还会把输入转换为模型的dtype，直接复用clip_loss.model只能得到fp16对fp16的比较
+    reference_model = copy.deepcopy(clip_loss.model).float()
+    with torch.no_grad():
+        c_loss_ref = clip_loss(img_chw.detach().float(), model=reference_model).float()
+    del reference_model
+    rel_err = ((c_loss_amp.detach() - c_loss_ref).abs() / c_loss_ref.abs().clamp(min=1e-8)).max().item()
+    status = "OK" if rel_err <= tolerance else "超出容差"
+    print(f"[AMP] CLIP损失 fp32: {c_loss_ref.max().item():.6f} | amp: {c_loss_amp.max().item():.6f} | 相对误差: {rel_err:.2e} ({status})")
+    return rel_err
+
+
+def check_synthesis_fp16(Synthesis, latent, img_gen):
+    # 对比fp16分块与强制fp32下的合成纹理
+    with torch.no_grad():
+        img_ref = Synthesis(latent.detach(), force_fp32=True)
+    max_err = (img_gen.detach().float() - img_ref).abs().max().item()
+    print(f"[AMP] Synthesis fp16 与 fp32 的最大绝对误差: {max_err:.2e}（纹理取值范围[-1, 1]）")
+    return max_err
+
+
+def prompt_checkpoint_path(opt):
+    return os.path.join(opt.result_dir, opt.name, "prompt_checkpoint.pth")
+
+
+def prompt_jobs(opt):
+    # 每个任务是一个 (prompt, 保存目录, 重启序号)：--prompts_file 中的每条prompt × --restarts 次随机重启
+    if opt.prompts_file:
+        with open(opt.prompts_file, encoding='utf-8') as f:
+            prompts = [line.strip() for line in f if line.strip()]
+    else:
+        prompts = [opt.prompt]
+    jobs = []
+    for prompt in prompts:
+        prompt_folder = os.path.join(opt.result_dir, opt.name, prompt if prompt else "default")
+        for k in range(opt.restarts):
+            jobs.append((prompt, prompt_folder if opt.restarts == 1 else os.path.join(prompt_folder, f"restart_{k}"), k))
+    return jobs
+
+
+def parse_resolutions(spec, synthesis):
+    # "all" 或逗号分隔的分辨率列表，例如 "128,256,512"
+    if spec == 'all':
+        return list(synthesis.block_resolutions)
+    return [int(res) for res in spec.split(',') if res.strip()]
+
+
+def profile_synthesis_checkpointing(Synthesis, runner, latent, device, repeats=3):
+    # 对比开启/关闭激活检查点时一次前向+反向的峰值显存与耗时
+    def measure(module):
+        latent_probe = latent.detach().clone().requires_grad_(True)
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+            torch.cuda.reset_peak_memory_stats(device)
+            base = torch.cuda.memory_allocated(device)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            module(latent_probe).square().mean().backward()
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+        elapsed = (time.perf_counter() - start) / repeats
+        peak = torch.cuda.max_memory_allocated(device) - base if device.type == 'cuda' else None
+        return elapsed, peak
+
+    time_ref, peak_ref = measure(Synthesis)
+    time_ckpt, peak_ckpt = measure(runner)
+    print(f"[激活检查点] 分辨率: {sorted(runner.checkpoint_resolutions)}")
+    print(f"[激活检查点] 每步耗时: {time_ref*1000:.1f}ms -> {time_ckpt*1000:.1f}ms（{time_ckpt/time_ref:.2f}x）")
+    if peak_ref is not None:
+        print(f"[激活检查点] 峰值显存: {peak_ref/2**20:.1f}MB -> {peak_ckpt/2**20:.1f}MB（节省 {(peak_ref-peak_ckpt)/2**20:.1f}MB）")
+
+
+def to_pil_image(texture):
+    # 与 torchvision ToPILImage 相同的转换（[3, H, W]、取值[0, 1]），不必为此导入torchvision
+    PIL_Image = lazy_import('PIL.Image')
+    return PIL_Image.fromarray(texture.mul(255).byte().permute(1, 2, 0).cpu().numpy(), mode='RGB')
+
+
+def write_bgr_image(image, path):
+    # image: 主机端RGB张量，取值[0, 1]，[H, W, 3] 或 [B, H, W, 3]（横向拼接）
+    cv2 = lazy_import('cv2')
+    image = image.float().numpy()
+    if image.ndim == 4:
+        image = np.concatenate(list(image), axis=1)
+    cv2.imwrite(path, image[..., [2, 1, 0]] * 255)
+
+
+def save_checkpoint(path, state):
+    # 先写临时文件再原子替换，被抢占时不会留下半个checkpoint
+    tmp_path = f"{path}.tmp"
+    torch.save(state, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def compact_adam(optimizer, new_param, index):
+    # 单参数Adam：参数换为new_param，exp_avg/exp_avg_sq按index收缩到保留的任务行（step是标量，原样保留）
+    group = optimizer.param_groups[0]
+    state = optimizer.state.pop(group['params'][0], {})
+    group['params'][0] = new_param
+    optimizer.state[new_param] = {key: value[index] if torch.is_tensor(value) and value.dim() > 0 else value for key, value in state.items()}
+
+
 def prompt_synthesis(ws,params,Synthesis):
-    trans_pil = ToPILImage()
-    latent_code_int = ws
+    # N个任务（不同prompt或同一prompt的多次随机重启）作为一个batch同时优化：
+    # 每步只做一次Synthesis/渲染/CLIP/反向传播，每个任务独立评估、保存最佳状态与报告
+    Texture_Network = lazy_import('model.Texture_Network')
+    innovations = lazy_import('innovations')
+    tqdm = lazy_import('tqdm').tqdm
+    save_image = lazy_import('torchvision.utils').save_image
+    jobs = prompt_jobs(opt)
+    num_jobs = len(jobs)
+
+    # 断点续跑时具体合成的结果（latent与形状参数锚点）取自断点，ws/params可以为None
+    checkpoint_path = prompt_checkpoint_path(opt)
+    checkpoint = torch.load(checkpoint_path, map_location=opt.device) if opt.resume and os.path.exists(checkpoint_path) else None
+    if checkpoint is not None:
+        ws, params = checkpoint['latent_init'], checkpoint['param_init']
+    latent_code_int = ws.expand(num_jobs, -1, -1)
+    params = params.expand(num_jobs, -1)
     param_init = params
 
     latent = latent_code_int.detach().clone()
+    if opt.restart_noise > 0:
+        # 随机重启：每条prompt的第一次运行保持原始latent，之后的重启加扰动（正则项仍以原始latent为锚点）
+        for k, (_, _, restart) in enumerate(jobs):
+            if restart > 0:
+                latent[k] += opt.restart_noise * torch.randn_like(latent[k])
     latent.requires_grad = True
     param = param_init.detach().clone()
     param.requires_grad = True
-    core = torch.from_numpy(np.load("./predef/core_1627_300_weight_10.npy")).cuda()
-
-    clip_loss = CLIPLoss()
+    device = torch.device(opt.device)
+    decoder = get_shape_decoder(opt,device)
+
+    # 混合精度：fp16时所有SynthesisBlock以fp16运行（分块按use_fp16自行转换dtype，ToRGB输出保持fp32），
+    # CLIP预处理与图像编码在autocast下运行，配合梯度缩放；PyTorch3D光栅化只支持fp32。
+    # CUDA上的CLIP权重本身是fp16，bf16只作用于CLIP预处理，Synthesis的分块不支持bf16。
+    amp_dtype = resolve_amp_dtype(opt, device)
+    use_amp = amp_dtype is not None
+    scaler = torch.cuda.amp.GradScaler(enabled=(amp_dtype == torch.float16))
+    fp16_resolutions = list(Synthesis.block_resolutions) if amp_dtype == torch.float16 else []
+
+    # 激活检查点：指定分辨率的SynthesisBlock在反向时重新计算，以时间换显存
+    # 分层优化：冻结低分辨率分块对应的ws，这些分块的输出只计算一次
+    checkpoint_resolutions = parse_resolutions(opt.synthesis_checkpoint, Synthesis) if opt.synthesis_checkpoint else []
+    freeze_resolutions = parse_resolutions(opt.freeze_resolutions, Synthesis) if opt.freeze_resolutions else []
+    if checkpoint_resolutions or freeze_resolutions or fp16_resolutions:
+        runner = Texture_Network.SynthesisRunner(Synthesis, checkpoint_resolutions=checkpoint_resolutions,
+                                                 freeze_resolutions=freeze_resolutions, fp16_resolutions=fp16_resolutions)
+        if opt.profile_checkpoint and checkpoint_resolutions:
+            profile_synthesis_checkpointing(Synthesis, runner, latent, device)
+        Synthesis = runner
+
+    clip_loss = CLIPLoss(prompt=[prompt for prompt, _, _ in jobs], device=device)
 
     # 创新点2：初始化渐进式优化器
-    progressive_opt = ProgressiveOptimizer(
+    progressive_opt = innovations.ProgressiveOptimizer(
         total_steps=opt.step,
         initial_lr_latent=opt.lr_latent,
         initial_lr_param=opt.lr_param,
         initial_lambda_latent=opt.lambda_latent,
-        initial_lambda_param=opt.lambda_param
+        initial_lambda_param=opt.lambda_param,
+        render_sizes=[int(size) for size in opt.render_sizes.split(',')]
     )
     
+    # Adam是逐元素的，对各任务损失求和后优化等价于各任务独立优化
     latent_optimizer = optim.Adam([latent], lr=opt.lr_latent)
     params_optimizer = optim.Adam([param], lr=opt.lr_param)
 
     # 创新点1：初始化多视角渲染器
-    multi_view_renderer = MultiViewRenderer(device="cuda", image_size=512)
-    
-    # 创新点3：初始化质量评估器
-    curr_save_folder = os.path.join(opt.result_dir, opt.name, opt.prompt if opt.prompt else "default")
-    if not os.path.exists(curr_save_folder):
-        os.makedirs(curr_save_folder, exist_ok=True)
-    quality_evaluator = QualityEvaluator(save_dir=curr_save_folder)
-
-    pbar = tqdm(range(opt.step))
+    multi_view_renderer = innovations.MultiViewRenderer(device=device, image_size=512, texture_mode=opt.texture_mode)
     
-    current_stage = ""
-
-    for i in pbar:
+    # 创新点3：每个任务一个质量评估器
+    quality_evaluators = [innovations.QualityEvaluator(save_dir=folder, flush_interval=opt.eval_flush_step) for _, folder, _ in jobs]
+    early_stoppings = [innovations.EarlyStopping(opt.patience, opt.min_delta, opt.min_steps) if opt.early_stop else None for _ in jobs]
+    active = [True] * num_jobs
+
+    # 提前结束的任务移出batch，不再参与合成、渲染与反向传播：latent/param、正则锚点、两个优化器的状态、
+    # CLIP文本特征与冻结分块缓存一起按保留的任务收缩；job_ids[j] 是batch第j行对应的任务
+    job_ids = list(range(num_jobs))
+    trainable_ws = None
+
+    def compact_jobs(keep):
+        nonlocal latent, param, latent_code_int, params, job_ids
+        index = torch.tensor([job_ids.index(k) for k in keep], device=device)
+        latent = latent.detach()[index].requires_grad_(True)
+        param = param.detach()[index].requires_grad_(True)
+        compact_adam(latent_optimizer, latent, index)
+        compact_adam(params_optimizer, param, index)
+        latent_code_int = latent_code_int[index]
+        params = params[index]
+        clip_loss.text_features = clip_loss.text_features[index]
+        if freeze_resolutions and Synthesis.coarse_cache is not None:
+            Synthesis.coarse_cache = tuple(None if t is None else t[index] for t in Synthesis.coarse_cache)
+        if trainable_ws is not None:
+            latent.register_hook(lambda grad: grad * trainable_ws)
+        job_ids = list(keep)
+
+    # 中间结果目录在循环前创建，后台写入任务不必各自检查
+    os.makedirs(os.path.join(opt.inter_dir, "texture_map"), exist_ok=True)
+    os.makedirs(os.path.join(opt.inter_dir, "render"), exist_ok=True)
+
+    # 中间结果的编码与写盘交给后台线程；with块在异常时也会排空队列
+    with AsyncResultWriter(num_workers=opt.writer_threads, max_pending=opt.writer_queue) as writer:
+        current_stage = ""
+        start_step = 0
+
+        # 影响优化状态含义的设置，恢复时必须与断点一致
+        settings = {
+            'amp': opt.amp if use_amp else 'none',
+            'freeze_resolutions': freeze_resolutions,
+            'restarts': opt.restarts,
+            'restart_noise': opt.restart_noise,
+        }
+
+        # 断点续跑：恢复latent/param、两个优化器、梯度缩放器、评估历史、步数与随机数状态
+        if checkpoint is not None:
+            if checkpoint['jobs'] != [prompt for prompt, _, _ in jobs]:
+                raise ValueError(f"checkpoint {checkpoint_path} was written for different prompts: {checkpoint['jobs']}")
+            saved_settings = checkpoint.get('settings', {})
+            mismatched = {key: (saved_settings.get(key), value) for key, value in settings.items() if saved_settings.get(key) != value}
+            if mismatched:
+                raise ValueError(f"checkpoint {checkpoint_path} was written with different settings (checkpoint, current): {mismatched}")
+            # 断点只保存仍在优化的任务的latent/param与优化器状态，先收缩batch再载入
+            active = checkpoint['active']
+            if not all(active):
+                compact_jobs([k for k in range(num_jobs) if active[k]])
+            with torch.no_grad():
+                latent.copy_(checkpoint['latent'])
+                param.copy_(checkpoint['param'])
+            latent_optimizer.load_state_dict(checkpoint['latent_optimizer'])
+            params_optimizer.load_state_dict(checkpoint['params_optimizer'])
+            scaler.load_state_dict(checkpoint['scaler'])
+            for quality_evaluator, state in zip(quality_evaluators, checkpoint['evaluators']):
+                quality_evaluator.load_state_dict(state)
+            for early_stopping, state in zip(early_stoppings, checkpoint['early_stoppings']):
+                if early_stopping is not None and state is not None:
+                    early_stopping.load_state_dict(state)
+            current_stage = checkpoint['stage']
+            start_step = checkpoint['step'] + 1
+            torch.set_rng_state(checkpoint['rng_state'].cpu())
+            if device.type == 'cuda' and checkpoint['cuda_rng_state'] is not None:
+                torch.cuda.set_rng_state(checkpoint['cuda_rng_state'].cpu(), device)
+            print(f"从 {checkpoint_path} 恢复，继续第 {start_step} 步")
+
+        if freeze_resolutions:
+            # 冻结部分的梯度置零（含L2正则项），Adam不会移动这些ws。
+            # 冻结分块的输出（含其随机噪声）随断点保存，恢复时直接载入，不在恢复的随机数状态上重新计算
+            if checkpoint is not None and checkpoint.get('coarse_cache') is not None:
+                Synthesis.coarse_cache = tuple(None if t is None else t.to(device) for t in checkpoint['coarse_cache'])
+            else:
+                Synthesis.cache_coarse(latent)
+            trainable_ws = Synthesis.trainable_ws_mask().to(device)[None, :, None]
+            latent.register_hook(lambda grad: grad * trainable_ws)
+            print(f"冻结分辨率 {freeze_resolutions}：优化 {int(trainable_ws.sum())}/{trainable_ws.numel()} 个ws")
+
+        pbar = tqdm(range(start_step, opt.step))
+        # 调试：统计每步的设备到主机拷贝次数
+        transfers_per_step = []
+
+        for i in pbar:
+            transfers_before = device_to_host_count()
         
-        # 创新点2：获取当前阶段的超参数
-        stage_params = progressive_opt.get_current_params(i)
+            # 创新点2：获取当前阶段的超参数
+            stage_params = progressive_opt.get_current_params(i)
         
-        # 如果进入新阶段，更新优化器学习率
-        if stage_params['stage'] != current_stage:
-            current_stage = stage_params['stage']
-            for param_group in latent_optimizer.param_groups:
-                param_group['lr'] = stage_params['lr_latent']
-            for param_group in params_optimizer.param_groups:
-                param_group['lr'] = stage_params['lr_param']
-
-        img_gen = Synthesis(latent)  ## 1*3*512*512
-
-        curr_verts = torch.matmul(param,core).reshape(-1,3)
-
-        render_img = img_gen.permute(0,2,3,1)
-
-        # 创新点1：使用多视角渲染（主要使用前视图进行优化）
-        img_pred = multi_view_renderer.render_multi_view(curr_verts, render_img, 'front')
-        img_rgb = img_pred.detach().cpu().numpy()[:,:,[2,1,0]]*255
-        img_chw = img_pred.unsqueeze(0).permute(0,3,1,2)
-
-        text_tokens = clip.tokenize(opt.prompt).cuda()
-        c_loss = clip_loss(img_chw,text_tokens)
-        l2_loss_latent = ((latent-latent_code_int)**2).sum()
-        l2_loss_param = ((param-params)**2).sum()
-
-        # 创新点1：添加多视角一致性损失（可选，通过配置开关）
-        if opt.use_multi_view and i % 5 == 0:  # 每5步计算一次以节省时间
-            consistency_loss = multi_view_renderer.compute_multi_view_consistency_loss(curr_verts, render_img)
-            consistency_weight = 0.1
-        else:
-            consistency_loss = 0.0
-            consistency_weight = 0.0
-
-        # 使用渐进式权重
-        loss = (c_loss + 
-                stage_params['lambda_latent'] * l2_loss_latent + 
-                stage_params['lambda_param'] * l2_loss_param +
-                consistency_weight * consistency_loss)
-
-        latent_optimizer.zero_grad()
-        params_optimizer.zero_grad()
-        loss.backward()
-        latent_optimizer.step()
-        params_optimizer.step()
-
-        # 创新点3：评估质量并保存最佳结果
-        is_best, quality_score = quality_evaluator.evaluate(
-            i, c_loss, l2_loss_latent, l2_loss_param, loss
-        )
+            # 如果进入新阶段，更新优化器学习率
+            if stage_params['stage'] != current_stage:
+                current_stage = stage_params['stage']
+                for param_group in latent_optimizer.param_groups:
+                    param_group['lr'] = stage_params['lr_latent']
+                for param_group in params_optimizer.param_groups:
+                    param_group['lr'] = stage_params['lr_param']
+
+            img_gen = Synthesis(latent)  ## N*3*512*512
+
+            curr_verts = decoder(param)  ## N*V*3
+
+            render_img = img_gen.permute(0,2,3,1)
+
+            # 创新点1：使用多视角渲染（主要使用前视图进行优化）
+            img_pred = multi_view_renderer.render_batch(curr_verts, render_img, 'front', stage_params['render_size'])
+            img_chw = img_pred.permute(0,3,1,2)
+
+            if use_amp:
+                with amp_autocast(device, amp_dtype):
+                    c_loss = clip_loss(img_chw.to(amp_dtype)).float()
+            else:
+                c_loss = clip_loss(img_chw)
+            if use_amp and opt.amp_check and i == start_step:
+                check_amp_accuracy(clip_loss, img_chw, c_loss)
+                if fp16_resolutions:
+                    check_synthesis_fp16(Synthesis, latent, img_gen)
+            l2_loss_latent = ((latent-latent_code_int)**2).sum(dim=[1,2])
+            l2_loss_param = ((param-params)**2).sum(dim=1)
+
+            # 创新点1：添加多视角一致性损失（可选，通过配置开关）
+            if opt.use_multi_view and i % 5 == 0:  # 每5步计算一次以节省时间
+                consistency_loss = torch.stack([
+                    multi_view_renderer.compute_multi_view_consistency_loss(curr_verts[j], render_img[j:j+1], stage_params['render_size'])
+                    for j in range(len(job_ids))
+                ])
+                consistency_weight = 0.1
+            else:
+                consistency_loss = 0.0
+                consistency_weight = 0.0
+
+            # 使用渐进式权重（每个任务一个损失值）
+            job_loss = (c_loss + 
+                    stage_params['lambda_latent'] * l2_loss_latent + 
+                    stage_params['lambda_param'] * l2_loss_param +
+                    consistency_weight * consistency_loss)
+            loss = job_loss.sum()
+
+            latent_optimizer.zero_grad()
+            params_optimizer.zero_grad()
+            scaler.scale(loss).backward()
+            scaler.step(latent_optimizer)
+            scaler.step(params_optimizer)
+            scaler.update()
+
+            # 创新点3：逐任务评估质量并在设备上保留最佳状态快照（不同步，按间隔flush）
+            for j, k in enumerate(job_ids):
+                quality_evaluator = quality_evaluators[k]
+                quality_evaluator.record(
+                    i, c_loss[j], l2_loss_latent[j], l2_loss_param[j], job_loss[j],
+                    latent=latent[j:j+1], param=param[j:j+1]
+                )
+
+                # 质量分数收敛后该任务提前结束，后续沿用最佳状态（在flush后的历史上判断）
+                if early_stoppings[k] is not None and early_stoppings[k].step(quality_evaluator):
+                    active[k] = False
+            if any(active) and sum(active) < len(job_ids):
+                compact_jobs([k for k in job_ids if active[k]])
+
+            # 进度条只显示已flush的指标，不为显示而同步
+            flushed = [k for k in range(num_jobs) if active[k] and quality_evaluators[k].history['iteration']]
+            if flushed:
+                pbar.set_description(
+                    (
+                        f"{current_stage} | loss: {np.mean([quality_evaluators[k].history['total_loss'][-1] for k in flushed]):.4f}"
+                        f" | quality: {min(quality_evaluators[k].history['quality_score'][-1] for k in flushed):.4f}"
+                    )
+                )
+
+            if opt.save_step > 0 and i % opt.save_step == 0:
+                # 直接复用本步的合成结果，不再额外前向一次Synthesis；只在保存步做非阻塞的主机拷贝
+                writer.submit_device(img_gen,save_image,f"{opt.inter_dir}/texture_map/{str(i).zfill(5)}_tex.jpg", normalize=True)
+                writer.submit_device(img_pred,write_bgr_image,os.path.join(opt.inter_dir,"render",f"{str(i).zfill(5)}_render.jpg"))
+
+            if opt.checkpoint_step > 0 and (i + 1) % opt.checkpoint_step == 0 and any(active):
+                if device.type == 'cuda':
+                    count_device_to_host()
+                save_checkpoint(checkpoint_path, {
+                    'jobs': [prompt for prompt, _, _ in jobs],
+                    'settings': settings,
+                    'step': i,
+                    'stage': current_stage,
+                    'latent': latent.detach(),
+                    'param': param.detach(),
+                    'latent_init': latent_code_int[:1],
+                    'param_init': params[:1],
+                    'latent_optimizer': latent_optimizer.state_dict(),
+                    'params_optimizer': params_optimizer.state_dict(),
+                    'scaler': scaler.state_dict(),
+                    'evaluators': [quality_evaluator.state_dict() for quality_evaluator in quality_evaluators],
+                    'early_stoppings': [None if early_stopping is None else early_stopping.state_dict() for early_stopping in early_stoppings],
+                    'active': active,
+                    'coarse_cache': Synthesis.coarse_cache if freeze_resolutions else None,
+                    'rng_state': torch.get_rng_state(),
+                    'cuda_rng_state': torch.cuda.get_rng_state(device) if device.type == 'cuda' else None,
+                })
+
+            if opt.debug_transfers:
+                transfers_per_step.append(device_to_host_count() - transfers_before)
+                pbar.set_postfix(d2h=transfers_per_step[-1])
+
+            if not any(active):
+                print("\n" + "\n".join(early_stopping.stop_reason for early_stopping in early_stoppings))
+                break
+
+        if opt.debug_transfers and transfers_per_step:
+            print(f"\n设备到主机拷贝: 共 {sum(transfers_per_step)} 次，平均每步 {np.mean(transfers_per_step):.2f} 次，"
+                  f"{sum(1 for n in transfers_per_step if n > 0)}/{len(transfers_per_step)} 步有拷贝")
+
+        # 创新点3：生成优化报告并加载每个任务的最佳结果
+        best_latents, best_params = [], []
+        for (prompt, curr_save_folder, _), quality_evaluator in zip(jobs, quality_evaluators):
+            report = quality_evaluator.generate_report()
+            print(f"\n=== 优化报告: {prompt} ===")
+            print(f"最佳迭代: {report['best_iteration']}")
+            print(f"最佳质量分数: {report['best_score']:.4f}")
+            print(f"报告已保存至: {curr_save_folder}")
         
-        if is_best:
-            quality_evaluator.save_best_state(latent, param, i)
-
-        pbar.set_description(
-            (
-                f"{current_stage} | loss: {loss.item():.4f} | quality: {quality_score:.4f}"
-            )
-        )
-
-        if opt.save_step > 0 and i % opt.save_step == 0:
-            with torch.no_grad():
-                img_gen = Synthesis(latent)
-
-            torchvision.utils.save_image(img_gen,f"{opt.inter_dir}/texture_map/{str(i).zfill(5)}_tex.jpg", normalize=True)
-            cv2.imwrite(os.path.join(opt.inter_dir,"render",f"{str(i).zfill(5)}_render.jpg"),img_rgb)
+            best_state = quality_evaluator.best_state()
+            best_latents.append(best_state['latent'])
+            best_params.append(best_state['param'])
+            print(f"已加载最佳结果（迭代 {best_state['iteration']}）")
+        latent = torch.cat(best_latents).to(device)
+        param = torch.cat(best_params).to(device)
 
-    # 创新点3：生成优化报告
-    report = quality_evaluator.generate_report()
-    print(f"\n=== 优化报告 ===")
-    print(f"最佳迭代: {report['best_iteration']}")
-    print(f"最佳质量分数: {report['best_score']:.4f}")
-    print(f"报告已保存至: {curr_save_folder}")
+        with torch.no_grad():
+            img_final = Synthesis(latent)
+            verts_final = decoder(param)
+        textures_final = [to_pil_image(tex) for tex in torch.clip((img_final+1)/2,0,1)]
+
+        template = get_template("./predef/mean_face_3DMM_300.obj")
+        for (prompt, curr_save_folder, _), texture_final, verts in zip(jobs, textures_final, verts_final.cpu().numpy()):
+            final_mesh = template.make_mesh(template.vertices + verts, texture=texture_final)
+            export_result(opt,final_mesh,curr_save_folder,"result_prompt")
     
-    # 加载最佳结果
-    best_state = torch.load(os.path.join(curr_save_folder, 'best_model.pth'))
-    latent = best_state['latent'].cuda()
-    param = best_state['param'].cuda()
-    print(f"已加载最佳结果（迭代 {best_state['iteration']}）")
+        # 创新点1：保存多视角渲染结果
+        if opt.save_multi_view:
+            print("\n生成多视角渲染图像...")
+            view_names = ['front', 'left', 'right', 'top_left', 'top_right']
+            with torch.no_grad():
+                render_img = img_final.permute(0,2,3,1)
+                for k, (prompt, curr_save_folder, _) in enumerate(jobs):
+                    view_imgs = multi_view_renderer.render_views(verts_final[k], render_img[k:k+1], view_names)
+                    for view_name, view_img in zip(view_names, view_imgs):
+                        writer.submit_device(view_img, write_bgr_image, os.path.join(curr_save_folder, f"view_{view_name}.jpg"))
+                    print(f"多视角图像已保存至: {curr_save_folder}")
+
+    # 退出with块时已等待所有后台写入完成；任务已完整结束，删除断点
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+
+def setup_device(opt):
+    # 选择执行设备；CPU上按配置设置intra-op/inter-op线程数
+    if opt.device.startswith('cuda') and not torch.cuda.is_available():
+        print("CUDA不可用，改用CPU执行")
+        opt.device = 'cpu'
+    device = torch.device(opt.device)
+    if device.type == 'cpu':
+        if opt.num_threads > 0:
+            torch.set_num_threads(opt.num_threads)
+        if opt.num_interop_threads > 0:
+            torch.set_num_interop_threads(opt.num_interop_threads)
+    return device
 
-    img_final = Synthesis(latent)
-    # texture_final = PIL.Image.fromarray(np.clip(np.uint8(((img_final[0].permute(1,2,0).detach().cpu().numpy()+1)/2)*255),0,255))
-    texture_final = trans_pil(torch.clip((img_final[0]+1)/2,0,1))
 
+def gen_full_mesh(opt):
 
-    verts_final = torch.matmul(param,core).reshape(-1,3).detach().cpu().numpy()
-    mean_mesh = load_ori_mesh("./predef/mean_face_3DMM_300.obj")
-    final_mesh = mean_mesh.copy()
-    final_mesh.visual.material.image = texture_final
-    final_mesh.vertices = mean_mesh.vertices + verts_final
+    setup_device(opt)
 
-    final_mesh.export(os.path.join(curr_save_folder,"result_prompt.obj"));
-    
-    # 创新点1：保存多视角渲染结果
-    if opt.save_multi_view:
-        print("\n生成多视角渲染图像...")
-        with torch.no_grad():
-            curr_verts = torch.matmul(param,core).reshape(-1,3)
-            render_img = img_final.permute(0,2,3,1)
-            
-            for view_name in ['front', 'left', 'right', 'top_left', 'top_right']:
-                view_img = multi_view_renderer.render_multi_view(curr_verts, render_img, view_name)
-                view_rgb = view_img.detach().cpu().numpy()[:,:,[2,1,0]]*255
-                cv2.imwrite(os.path.join(curr_save_folder, f"view_{view_name}.jpg"), view_rgb)
-        print(f"多视角图像已保存至: {curr_save_folder}")
+    configure_text_cache(opt.text_cache_dir, max_bytes=opt.text_cache_mb * 1024 * 1024)
+    get_assets(mmap=opt.mmap_assets)
 
+    try:
+        ## Batch Concrete Synthesis
+        if opt.descriptions_file:
+            batch_concrete_synthesis(opt)
+            return
 
-def gen_full_mesh(opt):
+        ## Resume Abstract Synthesis: 具体合成的结果已保存在断点中，不重新采样，也不覆盖result_concrete.obj
+        if (opt.prompt or opt.prompts_file) and opt.resume and os.path.exists(prompt_checkpoint_path(opt)):
+            Synthesis = get_registry().texture_net(opt.TextureNet_path, device=torch.device(opt.device)).synthesis
+            prompt_synthesis(None,None,Synthesis)
+            return
 
-    ## Text Parser: generate ont-hot code
-    all_label,shape_label,texture_label = gen_onehot(opt,text=opt.descriptions)
+        ## Text Parser: generate ont-hot code
+        all_label,shape_label,texture_label = gen_onehot(opt,text=opt.descriptions)
 
-    ## Concrete Synthesis
-    ws, pred_param, Synthesis = concrete_synthesis(opt,shape_label,texture_label)
+        ## Concrete Synthesis
+        ws, pred_param, Synthesis = concrete_synthesis(opt,shape_label,texture_label)
 
-    ## Abstract Synthesis
-    if opt.prompt:
-        prompt_synthesis(ws,pred_param,Synthesis)
+        ## Abstract Synthesis
+        if opt.prompt or opt.prompts_file:
+            prompt_synthesis(ws,pred_param,Synthesis)
+    finally:
+        if opt.profile_startup:
+            report_startup()
 
 
 if __name__ == '__main__':
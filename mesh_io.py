@@ -0,0 +1,249 @@
+"""
+网格读写：模板网格缓存与复用模板拓扑的紧凑二进制格式
+
+模板缓存：mean_face_3DMM_300.obj 只做一次文本解析，解析结果以 .npy 旁路文件
+保存在 <obj>.cache/ 下（可内存映射），按文件mtime/大小/sha1失效；
+新网格只替换顶点与纹理，面片与UV直接引用模板数组。
+
+紧凑格式：所有结果共享 mean_face_3DMM_300.obj 的拓扑，只有顶点和纹理不同。
+紧凑格式把共享部分每个输出根目录只写一次，每个结果只保存顶点与纹理。
+
+文件布局（均为 np.savez，不压缩）：
+
+    <root>/template_<digest>.npz       共享模板，digest为faces+uv的sha1前12位
+        faces        int32   [F, 3]    三角面顶点索引（0起）
+        uv           float32 [V, 2]    逐顶点UV，原点在左下角（同OBJ）
+
+    <result_dir>/<name>.npz            单个结果
+        template     str               模板文件相对于本文件目录的路径
+        vertices     float32 [V, 3]    顶点坐标（未量化时）
+        vertices_q   uint16  [V, 3]    量化顶点（--quantize_verts 时）
+        vertex_offset, vertex_scale    float32 [3]，vertices = vertices_q * scale + offset
+        texture_png  uint8   [N]       PNG编码的纹理图
+"""
+
+import hashlib
+import io
+import json
+import os
+import threading
+import uuid
+
+import numpy as np
+
+from startup_profile import lazy_import
+
+
+# to replace trimesh.load
+def load_ori_mesh(fn):
+    trimesh = lazy_import('trimesh')
+    return trimesh.load(fn,resolver=None,split_object=False,group_material=False,skip_materials=False,maintain_order=True,process=False)
+
+
+def _file_sha1(path):
+    hash_sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            hash_sha1.update(chunk)
+    return hash_sha1.hexdigest()
+
+
+class TemplateMesh:
+    """
+    解析一次、可内存映射的模板网格
+    vertices/faces/uv 为模板数组，make_mesh() 基于它们构建新的带纹理网格
+    """
+
+    CACHE_VERSION = 1
+    ARRAYS = ['vertices', 'faces', 'uv']
+
+    def __init__(self, obj_path, mmap=True):
+        self.obj_path = obj_path
+        self.cache_dir = obj_path + '.cache'
+        self.mmap = mmap
+        if not self._load_sidecar():
+            self._parse_and_store()
+
+    def _stat(self):
+        st = os.stat(self.obj_path)
+        return st.st_mtime_ns, st.st_size
+
+    def _load_sidecar(self):
+        meta_path = os.path.join(self.cache_dir, 'meta.json')
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if meta.get('version') != self.CACHE_VERSION:
+            return False
+
+        mtime_ns, size = self._stat()
+        if (meta['mtime_ns'], meta['size']) != (mtime_ns, size):
+            # mtime变化但内容未变（例如重新checkout）时沿用旁路文件
+            if meta['size'] != size or meta['sha1'] != _file_sha1(self.obj_path):
+                return False
+            meta['mtime_ns'] = mtime_ns
+            # 缓存目录只读时不更新时间戳，旁路文件已校验，照常使用
+            try:
+                self._write_meta(meta)
+            except OSError:
+                pass
+
+        try:
+            for name in self.ARRAYS:
+                setattr(self, name, np.load(os.path.join(self.cache_dir, name + '.npy'), mmap_mode='r' if self.mmap else None))
+        except (OSError, ValueError):
+            return False
+        self.material = meta['material']
+        return True
+
+    def _write_meta(self, meta):
+        tmp_path = os.path.join(self.cache_dir, f'meta.json.{uuid.uuid4().hex}.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, os.path.join(self.cache_dir, 'meta.json'))
+
+    def _parse_and_store(self):
+        mtime_ns, size = self._stat()
+        mesh = load_ori_mesh(self.obj_path)
+        self.vertices = np.ascontiguousarray(mesh.vertices, dtype=np.float64)
+        self.faces = np.ascontiguousarray(mesh.faces, dtype=np.int64)
+        self.uv = np.ascontiguousarray(mesh.visual.uv, dtype=np.float64)
+        material = mesh.visual.material
+        self.material = {
+            key: np.asarray(getattr(material, key)).tolist()
+            for key in ['ambient', 'diffuse', 'specular', 'glossiness']
+            if getattr(material, key, None) is not None
+        }
+        self.material['name'] = getattr(material, 'name', None)
+
+        # 旁路文件写失败（如只读目录）时只在内存中使用解析结果
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            for name in self.ARRAYS:
+                tmp_path = os.path.join(self.cache_dir, f'{name}.{uuid.uuid4().hex}.tmp')
+                with open(tmp_path, 'wb') as f:
+                    np.save(f, getattr(self, name))
+                os.replace(tmp_path, os.path.join(self.cache_dir, name + '.npy'))
+            self._write_meta({
+                'version': self.CACHE_VERSION,
+                'mtime_ns': mtime_ns,
+                'size': size,
+                'sha1': _file_sha1(self.obj_path),
+                'material': self.material,
+            })
+        except OSError:
+            pass
+
+    def make_mesh(self, vertices=None, texture=None):
+        """
+        构建新网格：只替换顶点与纹理，面片/UV引用模板数组而不复制
+
+        Args:
+            vertices: 顶点坐标 [V, 3]，None时使用模板顶点
+            texture: PIL纹理图
+        """
+        trimesh = lazy_import('trimesh')
+
+        material = trimesh.visual.material.SimpleMaterial(image=texture, **self.material)
+        visual = trimesh.visual.TextureVisuals(uv=self.uv, material=material)
+        return trimesh.Trimesh(
+            vertices=self.vertices if vertices is None else vertices,
+            faces=self.faces,
+            visual=visual,
+            process=False,
+            validate=False,
+        )
+
+
+_templates = {}
+_templates_lock = threading.Lock()
+
+
+def get_template(obj_path="./predef/mean_face_3DMM_300.obj"):
+    """返回进程内共享的模板网格（每个路径只解析一次）"""
+    key = os.path.abspath(obj_path)
+    with _templates_lock:
+        if key not in _templates:
+            _templates[key] = TemplateMesh(obj_path)
+        return _templates[key]
+
+
+def _atomic_savez(path, **arrays):
+    tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+
+def write_template(root, faces, uv):
+    """在root下写入共享模板（已存在则跳过），返回模板路径"""
+    faces = np.ascontiguousarray(faces, dtype=np.int32)
+    uv = np.ascontiguousarray(uv, dtype=np.float32)
+    digest = hashlib.sha1(faces.tobytes() + uv.tobytes()).hexdigest()[:12]
+    path = os.path.join(root, f'template_{digest}.npz')
+    if not os.path.exists(path):
+        os.makedirs(root, exist_ok=True)
+        _atomic_savez(path, faces=faces, uv=uv)
+    return path
+
+
+def export_compact(path, vertices, texture, faces, uv, template_root, quantize=False):
+    """
+    以紧凑格式导出一个结果
+
+    Args:
+        path: 输出文件路径（.npz）
+        vertices: 顶点坐标 [V, 3]
+        texture: PIL纹理图
+        faces, uv: 模板拓扑，仅在模板尚未写入时使用
+        template_root: 共享模板所在目录（通常为结果根目录）
+        quantize: 是否将顶点量化为uint16
+    """
+    template_path = write_template(template_root, faces, uv)
+    data = {'template': np.array(os.path.relpath(template_path, os.path.dirname(os.path.abspath(path))))}
+
+    vertices = np.asarray(vertices, dtype=np.float32)
+    if quantize:
+        offset = vertices.min(axis=0)
+        scale = (vertices.max(axis=0) - offset) / 65535.0
+        scale[scale == 0] = 1.0
+        data['vertices_q'] = np.round((vertices - offset) / scale).astype(np.uint16)
+        data['vertex_offset'] = offset.astype(np.float32)
+        data['vertex_scale'] = scale.astype(np.float32)
+    else:
+        data['vertices'] = vertices
+
+    buf = io.BytesIO()
+    texture.save(buf, format='PNG')
+    data['texture_png'] = np.frombuffer(buf.getvalue(), dtype=np.uint8)
+
+    _atomic_savez(path, **data)
+    return path
+
+
+def load_compact(path):
+    """读取紧凑格式结果，返回包含 vertices/faces/uv/texture(PIL) 的字典"""
+    PIL_Image = lazy_import('PIL.Image')
+
+    with np.load(path) as data:
+        template_path = os.path.join(os.path.dirname(os.path.abspath(path)), str(data['template']))
+        if 'vertices_q' in data:
+            vertices = data['vertices_q'].astype(np.float32) * data['vertex_scale'] + data['vertex_offset']
+        else:
+            vertices = data['vertices']
+        texture = PIL_Image.open(io.BytesIO(data['texture_png'].tobytes()))
+        texture.load()
+    with np.load(template_path) as template:
+        faces = template['faces']
+        uv = template['uv']
+    return {'vertices': vertices, 'faces': faces, 'uv': uv, 'texture': texture}
+
+
+def to_trimesh(record):
+    """把 load_compact 的结果转换为带纹理的trimesh网格（可再导出为OBJ/GLB）"""
+    trimesh = lazy_import('trimesh')
+
+    visual = trimesh.visual.TextureVisuals(uv=record['uv'], image=record['texture'])
+    return trimesh.Trimesh(vertices=record['vertices'], faces=record['faces'], visual=visual, process=False)
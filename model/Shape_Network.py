@@ -34,10 +34,25 @@ class MLP(torch.nn.Module):
 
     def forward(self,x):
 
-        noise = torch.randn(size=[x.shape[0],512]).cuda()
+        noise = torch.randn(size=[x.shape[0],512],device=x.device)
         x = torch.cat((x,noise),dim=-1)
         for idx in range(self.num_layers):
             layer = getattr(self,f'fc{idx}')
             x = layer(x)
 
         return x
+
+class ShapeDecoder(torch.nn.Module):
+    # 3DMM shape decoding: params [B,300] -> vertex offsets [B,V,3], done on the device of the core basis.
+    # The core basis may be kept in fp16/bf16 to halve its footprint; the result is returned in the input dtype.
+
+    def __init__(self,core):
+        super(ShapeDecoder,self).__init__()
+
+        self.register_buffer('core',core,persistent=False)
+
+    def forward(self,param):
+
+        verts = torch.matmul(param.to(self.core.dtype),self.core).to(param.dtype)
+
+        return verts.reshape(param.shape[0],-1,3)
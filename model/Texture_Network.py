@@ -11,8 +11,10 @@
 Matches the original implementation of configs E-F by Karras et al. at
 https://github.com/NVlabs/stylegan2/blob/master/training/networks_stylegan2.py"""
 
+import functools
 import numpy as np
 import torch
+import torch.utils.checkpoint
 from torch_utils import misc
 from torch_utils import persistence
 from torch_utils.ops import conv2d_resample
@@ -522,6 +524,93 @@ class SynthesisNetwork(torch.nn.Module):
             f'img_resolution={self.img_resolution:d}, img_channels={self.img_channels:d},',
             f'num_fp16_res={self.num_fp16_res:d}'])
 
+#----------------------------------------------------------------------------
+# Drives an existing SynthesisNetwork block by block. Networks restored from
+# pickles are rebuilt from the source embedded in the pickle, so features are
+# added here by wrapping the instance rather than by changing the classes above.
+
+class SynthesisRunner(torch.nn.Module):
+    def __init__(self,
+        synthesis,                          # SynthesisNetwork instance (possibly unpickled).
+        checkpoint_resolutions  = (),       # Resolutions whose blocks are recomputed in backward instead of keeping activations.
+        freeze_resolutions      = (),       # Leading (coarse) resolutions whose ws slices are frozen and whose outputs are cached.
+        fp16_resolutions        = (),       # Resolutions run in FP16 on CUDA, in addition to the network's own FP16 blocks.
+    ):
+        super().__init__()
+        self.synthesis = synthesis
+        self.block_resolutions = list(synthesis.block_resolutions)
+        self.checkpoint_resolutions = set(checkpoint_resolutions)
+        assert self.checkpoint_resolutions.issubset(self.block_resolutions)
+        self.freeze_resolutions = sorted(freeze_resolutions)
+        assert self.freeze_resolutions == self.block_resolutions[:len(self.freeze_resolutions)], 'frozen resolutions must be the leading blocks'
+        assert len(self.freeze_resolutions) < len(self.block_resolutions), 'at least one block must stay trainable'
+        self.fp16_resolutions = set(fp16_resolutions)
+        assert self.fp16_resolutions.issubset(self.block_resolutions)
+
+        # The ws consumed by the frozen blocks, including the torgb w that the last frozen block shares with the next block's first conv.
+        self.num_frozen_ws = 0
+        for res in self.freeze_resolutions:
+            block = getattr(synthesis, f'b{res}')
+            self.num_frozen_ws += block.num_conv
+        if self.freeze_resolutions:
+            self.num_frozen_ws += getattr(synthesis, f'b{self.freeze_resolutions[-1]}').num_torgb
+        self.coarse_cache = None
+
+    def trainable_ws_mask(self):
+        mask = torch.ones(self.synthesis.num_ws, dtype=torch.bool)
+        mask[:self.num_frozen_ws] = False
+        return mask
+
+    def cache_coarse(self, ws, **block_kwargs):
+        # Frozen blocks see the same ws on every step, so their (x, img) is computed once.
+        # With noise_mode='random' this also fixes the noise of the frozen layers to a single draw.
+        x = img = None
+        with torch.no_grad():
+            for res, cur_ws in zip(self.freeze_resolutions, self.split_ws(ws)):
+                x, img = self.run_block(res, x, img, cur_ws, **block_kwargs)
+        self.coarse_cache = (x, img)
+
+    def split_ws(self, ws):
+        block_ws = []
+        misc.assert_shape(ws, [None, self.synthesis.num_ws, self.synthesis.w_dim])
+        ws = ws.to(torch.float32)
+        w_idx = 0
+        for res in self.block_resolutions:
+            block = getattr(self.synthesis, f'b{res}')
+            block_ws.append(ws.narrow(1, w_idx, block.num_conv + block.num_torgb))
+            w_idx += block.num_conv
+        return block_ws
+
+    def call_block(self, res, x, img, cur_ws, **block_kwargs):
+        block = getattr(self.synthesis, f'b{res}')
+        if res not in self.fp16_resolutions or block.use_fp16:
+            return block(x, img, cur_ws, **block_kwargs)
+        # The block picks its dtype from use_fp16 on every call; the flag is only raised for this
+        # call so the shared (cached) network is left unchanged. Blocks still fall back to FP32 off CUDA.
+        block.use_fp16 = True
+        try:
+            return block(x, img, cur_ws, **block_kwargs)
+        finally:
+            block.use_fp16 = False
+
+    def run_block(self, res, x, img, cur_ws, **block_kwargs):
+        if res in self.checkpoint_resolutions and torch.is_grad_enabled():
+            # The RNG state is preserved, so noise_mode='random' recomputes identical noise.
+            # The recomputation goes through call_block() as well, so it uses the same dtype.
+            return torch.utils.checkpoint.checkpoint(functools.partial(self.call_block, res, **block_kwargs), x, img, cur_ws)
+        return self.call_block(res, x, img, cur_ws, **block_kwargs)
+
+    def forward(self, ws, **block_kwargs):
+        x = img = None
+        blocks = list(zip(self.block_resolutions, self.split_ws(ws)))
+        if self.coarse_cache is not None and self.coarse_cache[0].shape[0] == ws.shape[0]:
+            # Resume from the first trainable block; the frozen ws slices must match those given to cache_coarse().
+            x, img = self.coarse_cache
+            blocks = blocks[len(self.freeze_resolutions):]
+        for res, cur_ws in blocks:
+            x, img = self.run_block(res, x, img, cur_ws, **block_kwargs)
+        return img
+
 #----------------------------------------------------------------------------
 
 @persistence.persistent_class
@@ -0,0 +1,137 @@
+"""
+模型注册表：进程内常驻的模型缓存
+
+文本解析器、形状网络、纹理生成器(G_ema)与CLIP在进程内只加载一次，
+之后的调用直接复用；模型以推理模式（eval + 冻结参数）提供，
+并记录每个模型的加载耗时与常驻显存/内存占用。
+"""
+
+import threading
+import time
+
+import torch
+
+from startup_profile import lazy_import
+
+
+def _module_bytes(module):
+    """统计模块参数与缓冲区占用的字节数"""
+    total = 0
+    for t in list(module.parameters()) + list(module.buffers()):
+        total += t.numel() * t.element_size()
+    return total
+
+
+def _freeze(module):
+    """切换到推理模式：eval() 并关闭参数梯度（输入仍可反传梯度）"""
+    module.eval()
+    module.requires_grad_(False)
+    return module
+
+
+class ModelRegistry:
+    """
+    进程级模型注册表
+    以 (模型类型, 路径, 设备) 为键缓存已加载的模型
+    """
+
+    def __init__(self):
+        self._models = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _get(self, key, loader):
+        with self._lock:
+            if key in self._models:
+                self._stats[key]['hits'] += 1
+                return self._models[key]
+
+            device = torch.device(key[-1])
+            if device.type == 'cuda':
+                torch.cuda.synchronize(device)
+                mem_before = torch.cuda.memory_allocated(device)
+            start = time.perf_counter()
+            model = loader(device)
+            if device.type == 'cuda':
+                torch.cuda.synchronize(device)
+            load_time = time.perf_counter() - start
+
+            module = model[0] if isinstance(model, tuple) else model
+            stats = {
+                'load_time': load_time,
+                'param_bytes': _module_bytes(module),
+                'hits': 0,
+            }
+            if device.type == 'cuda':
+                stats['device_bytes'] = torch.cuda.memory_allocated(device) - mem_before
+            self._models[key] = model
+            self._stats[key] = stats
+            return model
+
+    def classifier(self, path, device='cuda'):
+        """文本解析器 Classify_Network.MLP"""
+        def loader(device):
+            from model import Classify_Network
+            model = Classify_Network.MLP()
+            state = torch.load(path, map_location='cpu')
+            model.load_state_dict(state['MLP'])
+            return _freeze(model.to(device))
+        return self._get(('classifier', path, str(device)), loader)
+
+    def shape_net(self, path, device='cuda'):
+        """形状网络 Shape_Network.MLP"""
+        def loader(device):
+            from model import Shape_Network
+            model = Shape_Network.MLP()
+            state = torch.load(path, map_location='cpu')
+            model.load_state_dict(state['MLP'])
+            return _freeze(model.to(device))
+        return self._get(('shape_net', path, str(device)), loader)
+
+    def texture_net(self, path, device='cuda'):
+        """纹理生成器 G_ema（通过 .mapping / .synthesis 访问两部分）"""
+        def loader(device):
+            dnnlib = lazy_import('dnnlib')
+            legacy = lazy_import('legacy')
+            with dnnlib.util.open_url(path) as f:
+                G = legacy.load_network_pkl(f)['G_ema']
+            return _freeze(G.to(device))
+        return self._get(('texture_net', path, str(device)), loader)
+
+    def clip(self, name='ViT-B/32', device='cuda'):
+        """CLIP模型，返回 (model, preprocess)"""
+        def loader(device):
+            clip = lazy_import('clip')
+            model, preprocess = clip.load(name, device=device)
+            if device.type == 'cpu':
+                # CPU上卷积(patch embedding)使用channels_last更快
+                model = model.to(memory_format=torch.channels_last)
+            return _freeze(model), preprocess
+        return self._get(('clip', name, str(device)), loader)
+
+    def stats(self):
+        """返回每个已加载模型的加载耗时与占用统计"""
+        with self._lock:
+            return {
+                f'{kind}:{name}@{device}': dict(stats)
+                for (kind, name, device), stats in self._stats.items()
+            }
+
+    def clear(self):
+        """释放所有常驻模型"""
+        with self._lock:
+            self._models.clear()
+            self._stats.clear()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+
+_registry = None
+
+
+def get_registry():
+    """返回进程内唯一的模型注册表"""
+    global _registry
+    if _registry is None:
+        _registry = ModelRegistry()
+    return _registry
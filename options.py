@@ -8,25 +8,59 @@ class Options():
     def initialize(self):
         self.parser.add_argument('--name', type=str, required=True, help="name of your result")
         self.parser.add_argument('--descriptions',type=str,default='',help="face descriptions")
+        self.parser.add_argument('--descriptions_file',type=str,default='',help="file with one face description per line (batch concrete synthesis)")
+        self.parser.add_argument('--batch_size',type=int,default=8,help="micro-batch size for batch concrete synthesis")
         self.parser.add_argument('--classfier_path',type=str,default='./checkpoints/onehot_classfier/latest_parser.pth')
         self.parser.add_argument('--ShapeNet_path',type=str,default='./checkpoints/shape_synthesis/latest_shape.pth')
         self.parser.add_argument('--TextureNet_path',type=str,default='./checkpoints/texture_synthesis/latest_texture.pkl')
         self.parser.add_argument('--prompt',type=str,default='',help="face descriptions")
+        self.parser.add_argument('--profile_startup','--profile-startup',action='store_true',help="report per-module import time and time to first useful work")
+        self.parser.add_argument('--device',type=str,default='cuda',help="execution device: cuda, cuda:N or cpu")
+        self.parser.add_argument('--num_threads',type=int,default=0,help="CPU intra-op threads (0 = torch default)")
+        self.parser.add_argument('--num_interop_threads',type=int,default=0,help="CPU inter-op threads (0 = torch default)")
+        self.parser.add_argument('--text_cache_dir',type=str,default="./cache/text_embeddings/",help="CLIP text embedding cache, empty to disable")
+        self.parser.add_argument('--text_cache_mb',type=int,default=256,help="max size of the text embedding cache (MB)")
+        self.parser.add_argument('--mmap_assets', action='store_true', help="memory-map the ./predef arrays instead of reading them into memory")
+        self.parser.add_argument('--core_dtype',type=str,default='fp32',choices=['fp32','fp16','bf16'],help="precision of the resident 3DMM core basis")
+        self.parser.add_argument('--prompts_file',type=str,default='',help="file with one prompt per line, optimized together as one batch")
+        self.parser.add_argument('--restarts',type=int,default=1,help="random restarts per prompt, optimized in the same batch")
+        self.parser.add_argument('--restart_noise',type=float,default=0.05,help="std of the noise added to the initial latent of each extra restart")
         self.parser.add_argument('--lr_latent',type=float,default=0.008,help="lr_latent")
         self.parser.add_argument('--lr_param',type=float,default=0.003,help="lr_param")
         self.parser.add_argument('--lambda_latent',type=float,default=0.0003,help="lambd_latent")
         self.parser.add_argument('--lambda_param',type=float,default=3,help="lambda_param")
 
+        self.parser.add_argument('--amp',type=str,default='none',choices=['none','fp16','bf16'],help="mixed precision in prompt synthesis: fp16 runs every SynthesisBlock in fp16 on CUDA and autocasts the CLIP loss; bf16 only autocasts the CLIP loss")
+        self.parser.add_argument('--amp_check',action='store_true',help="compare the mixed-precision CLIP loss (against a float32 CLIP copy) and synthesis output against fp32 on the first step")
+
+        self.parser.add_argument('--synthesis_checkpoint',type=str,default='',help="activation checkpointing for SynthesisNetwork blocks: 'all' or comma-separated resolutions, e.g. 256,512")
+        self.parser.add_argument('--freeze_resolutions',type=str,default='',help="freeze the ws of the leading SynthesisNetwork resolutions and cache their outputs, e.g. 4,8,16,32")
+        self.parser.add_argument('--profile_checkpoint',action='store_true',help="report peak memory and time per step with and without activation checkpointing")
+
         self.parser.add_argument('--save_step', type=int, default=5, help="save step")
         self.parser.add_argument('--step',type=int,default=100,help="all step")
+        self.parser.add_argument('--debug_transfers',action='store_true',help="report device-to-host transfers per prompt synthesis step")
+        self.parser.add_argument('--checkpoint_step', type=int, default=10, help="write a resumable prompt synthesis checkpoint every N steps (0 = off)")
+        self.parser.add_argument('--resume', action='store_true', help="resume prompt synthesis from result_dir/name/prompt_checkpoint.pth")
+        self.parser.add_argument('--writer_threads', type=int, default=2, help="background threads encoding/writing intermediate results")
+        self.parser.add_argument('--writer_queue', type=int, default=8, help="max pending intermediate writes before the loop blocks")
         # self.parser.add_argument('--concrete_dir',type=str,default="./result/concrete_synthesis/",help="concrete save path")
         # self.parser.add_argument('--prompt_dir',type=str,default="./result/prompt_synthesis/",help="prompt save path")
         self.parser.add_argument('--result_dir',type=str,default="./result/final_result/",help="result save path")
+        self.parser.add_argument('--export_format',type=str,default='obj',choices=['obj','npz'],help="obj: full OBJ/MTL/PNG, npz: compact binary sharing one template per result_dir")
+        self.parser.add_argument('--quantize_verts',action='store_true',help="store npz vertices as uint16 instead of float32")
         self.parser.add_argument('--inter_dir',type=str,default="./result/inter_result/",help="intermediate result")
         
         # 创新点相关参数
         self.parser.add_argument('--use_multi_view', action='store_true', help="enable multi-view consistency loss")
         self.parser.add_argument('--save_multi_view', action='store_true', help="save multi-view renderings")
+        self.parser.add_argument('--eval_flush_step',type=int,default=10,help="copy quality metrics to the host and write best_model.pth every N steps")
+        self.parser.add_argument('--early_stop', action='store_true', help="stop prompt synthesis once the quality score stops improving")
+        self.parser.add_argument('--patience', type=int, default=20, help="early stop after this many steps without improvement")
+        self.parser.add_argument('--min_delta', type=float, default=1e-4, help="minimum quality score decrease counted as improvement")
+        self.parser.add_argument('--min_steps', type=int, default=30, help="never early stop before this many steps")
+        self.parser.add_argument('--render_sizes',type=str,default='224,224,512',help="render resolution for each of the three progressive stages")
+        self.parser.add_argument('--texture_mode', type=str, default='vertex', choices=['vertex', 'uv'], help="vertex: per-vertex colors sampled at the mesh UVs, uv: UV-textured render")
 
 
 
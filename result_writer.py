@@ -0,0 +1,138 @@
+"""
+异步结果写入器：中间结果的编码与磁盘写入移出优化循环
+
+有界队列 + 线程池：submit() 只接收已拷贝到主机的数据，
+JPEG/PNG编码和文件写入在后台线程完成；队列满时submit阻塞（背压），
+close() 等待所有任务完成；submit() 与 close() 都会抛出后台线程中的第一个异常，写入出错时优化循环尽早停止。
+
+submit_device() 接收设备张量：拷贝以non_blocking方式写入复用的页锁定(pinned)
+缓冲区，由后台线程等待拷贝完成后再写盘，优化循环本身不等待设备。
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+
+# 调试计数：经由 PinnedStager、评估器flush与断点保存发起的设备到主机拷贝次数
+_device_to_host = {'count': 0}
+
+
+def count_device_to_host(n=1):
+    _device_to_host['count'] += n
+
+
+def device_to_host_count():
+    return _device_to_host['count']
+
+
+class PinnedStager:
+    """
+    设备到主机的非阻塞拷贝
+    页锁定缓冲区按 (形状, dtype) 复用，拷贝完成由CUDA事件标记；CPU张量原样返回
+    """
+
+    def __init__(self):
+        self._free = {}
+        self._lock = threading.Lock()
+
+    def copy(self, tensor):
+        """发起拷贝，返回 (主机张量, 事件)；事件为None表示数据已可用"""
+        tensor = tensor.detach()
+        if not tensor.is_cuda:
+            return tensor, None
+        key = (tuple(tensor.shape), tensor.dtype)
+        with self._lock:
+            pool = self._free.get(key)
+            host = pool.pop() if pool else None
+        if host is None:
+            host = torch.empty(tensor.shape, dtype=tensor.dtype, pin_memory=True)
+        # 拷贝与事件都放在源张量所在设备的当前流上（--device cuda:N 时当前设备不一定是N）
+        with torch.cuda.device(tensor.device):
+            host.copy_(tensor, non_blocking=True)
+            event = torch.cuda.Event()
+            event.record(torch.cuda.current_stream(tensor.device))
+        count_device_to_host()
+        return host, event
+
+    def release(self, host):
+        """主机张量用完后归还缓冲区"""
+        if host.is_pinned():
+            with self._lock:
+                self._free.setdefault((tuple(host.shape), host.dtype), []).append(host)
+
+
+class AsyncResultWriter:
+    """
+    后台写入器
+    用法：
+        with AsyncResultWriter() as writer:
+            writer.submit(cv2.imwrite, path, img)
+    """
+
+    def __init__(self, num_workers=2, max_pending=8):
+        self._executor = ThreadPoolExecutor(max_workers=max(1, num_workers), thread_name_prefix='result_writer')
+        self._slots = threading.BoundedSemaphore(max(1, max_pending))
+        self._errors = []
+        self._closed = False
+        self._stager = PinnedStager()
+
+    def submit(self, fn, *args, **kwargs):
+        """提交一个写入任务；参数必须是主机端数据（已detach的CPU张量或NumPy数组）"""
+        if self._closed:
+            raise RuntimeError('AsyncResultWriter is closed')
+        if self._errors:
+            raise self._errors[0]
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(self._on_done)
+        return future
+
+    def submit_device(self, tensor, fn, *args, **kwargs):
+        """
+        提交一个以设备张量为第一个参数的写入任务：fn(主机张量, *args, **kwargs)
+        主线程只发起非阻塞拷贝，等待拷贝完成与写盘都在后台线程中进行
+        """
+        host, event = self._stager.copy(tensor)
+
+        def task():
+            try:
+                if event is not None:
+                    event.synchronize()
+                return fn(host, *args, **kwargs)
+            finally:
+                self._stager.release(host)
+
+        return self.submit(task)
+
+    def _on_done(self, future):
+        self._slots.release()
+        error = future.exception()
+        if error is not None:
+            self._errors.append(error)
+
+    def close(self):
+        """等待所有挂起任务写完；可重复调用"""
+        if self._closed:
+            return
+        self._closed = True
+        self._executor.shutdown(wait=True)
+        if self._errors:
+            raise self._errors[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # 已有异常时仍然排空队列，但不覆盖原始异常
+            self._closed = True
+            self._executor.shutdown(wait=True)
+        return False
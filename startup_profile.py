@@ -0,0 +1,46 @@
+"""
+启动耗时记录（--profile_startup）
+
+重量级依赖（pytorch3d/clip/cv2/trimesh/matplotlib等）通过 lazy_import 推迟到用到它们的阶段再导入，
+首次导入的耗时记录在 _STARTUP 中；main.py 最先导入本模块，计时起点即进程开始加载main.py的时间。
+"""
+
+import importlib
+import sys
+import time
+
+_STARTUP_T0 = time.perf_counter()
+_STARTUP = {'core_imports': None, 'imports': {}, 'first_work': None}
+
+
+def lazy_import(name):
+    # 首次导入时记录耗时
+    module = sys.modules.get(name)
+    if module is None:
+        start = time.perf_counter()
+        module = importlib.import_module(name)
+        _STARTUP['imports'][name] = time.perf_counter() - start
+    return module
+
+
+def mark_core_imports():
+    # 入口模块的顶层导入（torch/numpy/本地模块）完成时间
+    if _STARTUP['core_imports'] is None:
+        _STARTUP['core_imports'] = time.perf_counter() - _STARTUP_T0
+
+
+def mark_first_work():
+    # 第一次有用的计算（文本解析出结果）距进程加载main.py的时间
+    if _STARTUP['first_work'] is None:
+        _STARTUP['first_work'] = time.perf_counter() - _STARTUP_T0
+
+
+def report_startup():
+    print("\n=== 启动耗时 ===")
+    if _STARTUP['core_imports'] is not None:
+        print(f"核心导入(torch/numpy/本地模块): {_STARTUP['core_imports']*1000:.1f}ms")
+    for name, seconds in sorted(_STARTUP['imports'].items(), key=lambda item: -item[1]):
+        print(f"  import {name}: {seconds*1000:.1f}ms")
+    if _STARTUP['first_work'] is not None:
+        print(f"首个有效计算完成: {_STARTUP['first_work']*1000:.1f}ms")
+    print(f"总耗时: {(time.perf_counter() - _STARTUP_T0)*1000:.1f}ms")
@@ -56,6 +56,11 @@ def test_progressive_optimizer():
             print(f"    lr_param: {params['lr_param']:.6f}")
             print(f"    lambda_latent: {params['lambda_latent']:.6f}")
             print(f"    lambda_param: {params['lambda_param']:.2f}")
+            print(f"    render_size: {params['render_size']}")
+        
+        # 前两个阶段低分辨率渲染，最终精细化阶段使用全分辨率
+        assert opt.get_current_params(0)['render_size'] == 224
+        assert opt.get_current_params(99)['render_size'] == 512
         
         print("\n✓ 渐进式优化器测试通过")
         return True
@@ -129,6 +134,18 @@ def test_quality_evaluator():
             print(f"  {status} {os.path.basename(f)}")
             all_exist = all_exist and exists
         
+        # 按间隔flush：record不同步，flush后history与最佳状态快照才更新
+        buffered = QualityEvaluator(save_dir=temp_dir, flush_interval=4)
+        latents = [torch.full((1, 4), float(i)) for i in range(6)]
+        for i in range(6):
+            loss = torch.tensor(0.5 - i * 0.03 if i < 3 else 0.5)
+            buffered.record(i, loss, loss * 0, loss * 0, loss, latent=latents[i], param=latents[i])
+        assert len(buffered.history['iteration']) == 4
+        buffered.flush()
+        assert len(buffered.history['iteration']) == 6 and buffered.best_iteration == 2
+        assert torch.equal(buffered.best_state()['latent'], latents[2])
+        print("✓ 按间隔flush与最佳状态快照正常")
+        
         # 清理临时文件
         import shutil
         shutil.rmtree(temp_dir)
@@ -163,6 +180,22 @@ def test_multi_view_renderer_init():
         for view_name, params in renderer.view_angles.items():
             print(f"  {view_name}: elev={params['elev']}°, azim={params['azim']}°")
         
+        # 同一视角的渲染管线应被缓存复用
+        assert renderer.get_pipeline('front') is renderer.get_pipeline('front')
+        assert renderer.get_pipeline('unknown') is renderer.get_pipeline('front')
+        print("\n✓ 渲染管线缓存复用正常")
+        
+        # 批量视角：命名视角与 (elev, azim) 元组可以混用
+        turntable = renderer.turntable_views(8, elev=10)
+        assert len(turntable) == 8 and turntable[2] == (10, 90.0)
+        views = ['front', 'left'] + turntable
+        assert renderer.get_pipeline(views) is renderer.get_pipeline(views)
+        print("✓ 批量视角渲染管线构建正常")
+        
+        # 不同分辨率各自缓存一条渲染管线
+        assert renderer.get_pipeline('front', 224) is renderer.get_pipeline('front', 224)
+        assert renderer.get_pipeline('front', 224) is not renderer.get_pipeline('front')
+        
         print("\n✓ 多视角渲染器初始化成功")
         print("  注意: 完整的渲染测试需要预训练模型和GPU环境")
         return True
@@ -173,6 +206,268 @@ def test_multi_view_renderer_init():
         traceback.print_exc()
         return False
 
+def test_early_stopping():
+    """测试早停策略"""
+    print("\n" + "=" * 70)
+    print("测试5: 早停策略")
+    print("=" * 70)
+    
+    try:
+        from innovations import QualityEvaluator, EarlyStopping
+        import tempfile
+        import shutil
+        import json
+        
+        temp_dir = tempfile.mkdtemp()
+        evaluator = QualityEvaluator(save_dir=temp_dir)
+        early_stopping = EarlyStopping(patience=5, min_delta=1e-3, min_steps=10)
+        
+        # 模拟前8步损失下降、之后持平的优化过程
+        stopped_at = None
+        for i in range(100):
+            clip_loss = torch.tensor(max(0.5 - i * 0.03, 0.26))
+            l2 = torch.tensor(0.0)
+            evaluator.evaluate(i, clip_loss, l2, l2, clip_loss)
+            if early_stopping.step(evaluator):
+                stopped_at = i
+                break
+        
+        print(f"\n  停止于迭代 {stopped_at}: {early_stopping.stop_reason}")
+        assert stopped_at is not None and stopped_at >= 10
+        assert stopped_at - early_stopping.best_iteration == 5
+        
+        # 断点续跑：评估器与早停状态可以完整恢复
+        restored = QualityEvaluator(save_dir=temp_dir)
+        restored.load_state_dict(evaluator.state_dict())
+        assert restored.history == evaluator.history
+        assert restored.best_iteration == evaluator.best_iteration
+        restored_stopping = EarlyStopping()
+        restored_stopping.load_state_dict(early_stopping.state_dict())
+        assert restored_stopping.best_iteration == early_stopping.best_iteration
+        
+        report = evaluator.generate_report()
+        with open(os.path.join(temp_dir, 'optimization_report.json')) as f:
+            saved = json.load(f)
+        assert saved['stop_iteration'] == stopped_at
+        assert saved['stop_reason'] == report['stop_reason']
+        shutil.rmtree(temp_dir)
+        
+        print("\n✓ 早停策略测试通过")
+        return True
+        
+    except Exception as e:
+        print(f"✗ 测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def test_clip_preprocess():
+    """测试CLIP预处理与原7倍上采样+平均池化的一致性"""
+    print("\n" + "=" * 70)
+    print("测试6: CLIP预处理")
+    print("=" * 70)
+    
+    try:
+        from main import CLIPPreprocess, CLIP_MEAN, CLIP_STD
+        
+        preprocess = CLIPPreprocess(224)
+        image = torch.rand(2, 3, 512, 512, dtype=torch.float64)
+        
+        # 去掉mean/std归一化后与原先的 Upsample(7) + AvgPool2d(16) 比较
+        mean = torch.tensor(CLIP_MEAN, dtype=torch.float64).view(1, 3, 1, 1)
+        std = torch.tensor(CLIP_STD, dtype=torch.float64).view(1, 3, 1, 1)
+        resized = preprocess(image) * std + mean
+        reference = torch.nn.AvgPool2d(kernel_size=16)(torch.nn.Upsample(scale_factor=7)(image))
+        
+        max_err = (resized - reference).abs().max().item()
+        print(f"\n  输出尺寸: {tuple(resized.shape)}")
+        print(f"  与 Upsample(7)+AvgPool2d(16) 的最大误差: {max_err:.2e}")
+        assert resized.shape == (2, 3, 224, 224)
+        assert max_err < 1e-10
+        
+        # 已是编码器分辨率的输入只做归一化
+        small = torch.rand(1, 3, 224, 224, dtype=torch.float64)
+        assert torch.allclose(preprocess(small), (small - mean) / std)
+        
+        print("\n✓ CLIP预处理测试通过")
+        return True
+        
+    except Exception as e:
+        print(f"✗ 测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def test_text_embedding_cache():
+    """测试文本嵌入磁盘缓存"""
+    print("\n" + "=" * 70)
+    print("测试7: 文本嵌入缓存")
+    print("=" * 70)
+    
+    try:
+        from embedding_cache import TextEmbeddingCache
+        import tempfile
+        import shutil
+        
+        temp_dir = tempfile.mkdtemp()
+        features = {text: np.random.randn(512).astype(np.float32) for text in ['a', 'b', 'c']}
+        
+        # 上限只够容纳两条记录
+        probe = TextEmbeddingCache(os.path.join(temp_dir, 'probe'))
+        probe.put('ViT-B/32', 'a', features['a'])
+        entry_bytes = probe.stats()['bytes']
+        cache = TextEmbeddingCache(os.path.join(temp_dir, 'cache'), max_bytes=2 * entry_bytes)
+        
+        # 未命中
+        assert cache.get('ViT-B/32', 'a') is None
+        assert cache.stats()['misses'] == 1
+        
+        # 写入后命中；不同模型名是不同的键；normalize返回单位向量
+        cache.put('ViT-B/32', 'a', features['a'])
+        cache.put('ViT-B/32', 'b', features['b'])
+        assert np.array_equal(cache.get('ViT-B/32', 'a'), features['a'])
+        assert cache.get('RN50', 'a') is None
+        assert abs(np.linalg.norm(cache.get('ViT-B/32', 'a', normalize=True)) - 1) < 1e-5
+        
+        # LRU：a刚被读取，写入c时淘汰最久未用的b
+        cache.put('ViT-B/32', 'c', features['c'])
+        assert cache.get('ViT-B/32', 'b') is None
+        assert np.array_equal(cache.get('ViT-B/32', 'c'), features['c'])
+        assert cache.stats()['entries'] == 2 and cache.stats()['bytes'] <= cache.max_bytes
+        print(f"\n  缓存统计: {cache.stats()}")
+        
+        # 原子写：覆盖写入不增加记录，也不留下临时文件
+        cache.put('ViT-B/32', 'a', features['a'])
+        assert cache.stats()['entries'] == 2
+        leftovers = [f for _, _, files in os.walk(cache.cache_dir) for f in files if not f.endswith('.npy')]
+        assert not leftovers, leftovers
+        
+        # 新进程：命中读取不扫描磁盘，统计或写入时才重建索引
+        reopened = TextEmbeddingCache(cache.cache_dir, max_bytes=cache.max_bytes)
+        assert np.array_equal(reopened.get('ViT-B/32', 'a'), features['a'])
+        assert reopened._entries is None
+        assert reopened.stats()['entries'] == 2
+        
+        shutil.rmtree(temp_dir)
+        print("\n✓ 文本嵌入缓存测试通过")
+        return True
+        
+    except Exception as e:
+        print(f"✗ 测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def test_compact_export():
+    """测试紧凑网格格式的导出与读取"""
+    print("\n" + "=" * 70)
+    print("测试8: 紧凑网格格式")
+    print("=" * 70)
+    
+    try:
+        from mesh_io import export_compact, load_compact
+        import PIL.Image
+        import tempfile
+        import shutil
+        
+        temp_dir = tempfile.mkdtemp()
+        num_verts = 100
+        vertices = np.random.randn(num_verts, 3).astype(np.float32)
+        faces = np.random.randint(0, num_verts, size=(150, 3))
+        uv = np.random.rand(num_verts, 2)
+        texture = PIL.Image.fromarray(np.random.randint(0, 256, size=(16, 16, 3), dtype=np.uint8))
+        
+        # 未量化：顶点、拓扑与纹理无损往返
+        path = export_compact(os.path.join(temp_dir, 'a', 'result.npz'), vertices, texture, faces, uv, template_root=temp_dir)
+        with np.load(path) as data:
+            assert set(data.files) == {'template', 'vertices', 'texture_png'}
+        record = load_compact(path)
+        assert np.array_equal(record['vertices'], vertices)
+        assert np.array_equal(record['faces'], faces) and record['faces'].dtype == np.int32
+        assert np.array_equal(record['uv'], uv.astype(np.float32))
+        assert np.array_equal(np.asarray(record['texture']), np.asarray(texture))
+        
+        # 量化：uint16顶点，误差不超过半个量化步长；共享模板只写一次
+        path_q = export_compact(os.path.join(temp_dir, 'b', 'result.npz'), vertices, texture, faces, uv, template_root=temp_dir, quantize=True)
+        with np.load(path_q) as data:
+            assert set(data.files) == {'template', 'vertices_q', 'vertex_offset', 'vertex_scale', 'texture_png'}
+            assert data['vertices_q'].dtype == np.uint16
+            scale = data['vertex_scale']
+        record_q = load_compact(path_q)
+        max_err = np.abs(record_q['vertices'] - vertices).max(axis=0)
+        print(f"\n  量化误差: {max_err}（步长 {scale}）")
+        assert np.all(max_err <= scale / 2 + 1e-6)
+        assert np.array_equal(record_q['faces'], faces)
+        templates = [f for f in os.listdir(temp_dir) if f.startswith('template_')]
+        assert len(templates) == 1, templates
+        
+        shutil.rmtree(temp_dir)
+        print("\n✓ 紧凑网格格式测试通过")
+        return True
+        
+    except Exception as e:
+        print(f"✗ 测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def test_synthesis_runner():
+    """测试SynthesisRunner的冻结缓存、激活检查点与ws掩码"""
+    print("\n" + "=" * 70)
+    print("测试9: SynthesisRunner")
+    print("=" * 70)
+    
+    try:
+        from model import Texture_Network
+        
+        torch.manual_seed(0)
+        synthesis = Texture_Network.SynthesisNetwork(w_dim=32, img_resolution=32, img_channels=3, channel_base=512, channel_max=32).eval()
+        ws = torch.randn(2, synthesis.num_ws, 32)
+        
+        ws_ref = ws.clone().requires_grad_(True)
+        img_ref = synthesis(ws_ref, noise_mode='const')
+        img_ref.square().sum().backward()
+        
+        # 冻结4/8分辨率并缓存其输出后，从16分辨率继续合成，结果与完整前向一致
+        frozen = Texture_Network.SynthesisRunner(synthesis, freeze_resolutions=[4, 8])
+        frozen.cache_coarse(ws, noise_mode='const')
+        img_frozen = frozen(ws, noise_mode='const')
+        print(f"\n  冻结+缓存 最大误差: {(img_frozen - img_ref).abs().max().item():.2e}")
+        assert torch.allclose(img_frozen, img_ref, atol=1e-5)
+        
+        # 激活检查点（含fp16分块标记，CPU上分块自行回退到fp32）：前向与梯度都与完整前向一致
+        checkpointed = Texture_Network.SynthesisRunner(synthesis, checkpoint_resolutions=[16, 32], fp16_resolutions=[16, 32])
+        ws_ckpt = ws.clone().requires_grad_(True)
+        img_ckpt = checkpointed(ws_ckpt, noise_mode='const')
+        img_ckpt.square().sum().backward()
+        print(f"  激活检查点 最大误差: {(img_ckpt - img_ref).abs().max().item():.2e}")
+        assert torch.allclose(img_ckpt, img_ref, atol=1e-5)
+        assert torch.allclose(ws_ckpt.grad, ws_ref.grad, atol=1e-4)
+        assert not synthesis.b16.use_fp16 and not synthesis.b32.use_fp16
+        
+        # 掩码恰好屏蔽冻结分块读取的ws（含与下一分块共享的torgb w）：
+        # 用完整网络中最后一个冻结分块输出对ws的梯度独立确定这些ws
+        outputs = []
+        handle = synthesis.b8.register_forward_hook(lambda module, inputs, output: outputs.append(output))
+        ws_probe = ws.clone().requires_grad_(True)
+        synthesis(ws_probe, noise_mode='const')
+        handle.remove()
+        x, img = outputs[0]
+        (x.sum() + img.sum()).backward()
+        read_by_frozen = ws_probe.grad.abs().sum(dim=[0, 2]) > 0
+        mask = frozen.trainable_ws_mask()
+        print(f"  冻结ws: {(~mask).nonzero().flatten().tolist()} / {synthesis.num_ws}")
+        assert torch.equal(mask, ~read_by_frozen)
+        
+        print("\n✓ SynthesisRunner测试通过")
+        return True
+        
+    except Exception as e:
+        print(f"✗ 测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
 def main():
     """运行所有测试"""
     print("\n" + "=" * 70)
@@ -187,6 +482,11 @@ def main():
     results.append(("渐进式优化器", test_progressive_optimizer()))
     results.append(("质量评估器", test_quality_evaluator()))
     results.append(("多视角渲染器", test_multi_view_renderer_init()))
+    results.append(("早停策略", test_early_stopping()))
+    results.append(("CLIP预处理", test_clip_preprocess()))
+    results.append(("文本嵌入缓存", test_text_embedding_cache()))
+    results.append(("紧凑网格格式", test_compact_export()))
+    results.append(("SynthesisRunner", test_synthesis_runner()))
     
     # 总结
     print("\n" + "=" * 70)
@@ -0,0 +1,65 @@
+"""Ahead-of-time build of all custom ops into the prebuilt artifact directory.
+
+Usage:
+    python -m torch_utils.build_ops [--out DIR] [--verbose]
+
+Each plugin is compiled once and copied to
+<DIR>/<module_name>/<source digest>-torch<version>-cuda<version>-<gpu>/,
+where custom_ops.get_plugin() then loads it directly. Run the command on
+each (torch version, GPU) combination used by the workers, and point
+TORCH_UTILS_PREBUILT_DIR at DIR if it is not the default location.
+"""
+
+import argparse
+import sys
+
+import torch
+
+from . import custom_ops
+from .ops import bias_act, filtered_lrelu, upfirdn2d
+
+#----------------------------------------------------------------------------
+
+PLUGINS = {
+    'bias_act_plugin':          bias_act,
+    'upfirdn2d_plugin':         upfirdn2d,
+    'filtered_lrelu_plugin':    filtered_lrelu,
+}
+
+#----------------------------------------------------------------------------
+
+def build_all(out_dir=None, verbose=False):
+    """Build every plugin into out_dir; returns the names of the plugins that failed."""
+    if not torch.cuda.is_available():
+        raise RuntimeError('Building the custom ops requires a CUDA device')
+    if out_dir is not None:
+        custom_ops.prebuilt_dir = out_dir
+    custom_ops.export_prebuilt = True
+    custom_ops.verbosity = 'full' if verbose else 'brief'
+
+    failed = []
+    for name, module in PLUGINS.items():
+        if not module._init(): # pylint: disable=protected-access
+            failed.append(name)
+    return failed
+
+#----------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the torch_utils custom ops ahead of time.')
+    parser.add_argument('--out', type=str, default=None, help=f'artifact directory (default: {custom_ops.prebuilt_dir})')
+    parser.add_argument('--verbose', action='store_true', help='print the full build log')
+    args = parser.parse_args()
+
+    failed = build_all(args.out, verbose=args.verbose)
+    print(f'Prebuilt plugins in "{custom_ops.prebuilt_dir}": {len(PLUGINS) - len(failed)}/{len(PLUGINS)} built')
+    if failed:
+        print(f'Failed: {", ".join(failed)} (rerun with --verbose for the build log)')
+        sys.exit(1)
+
+#----------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    main()
+
+#----------------------------------------------------------------------------
@@ -9,9 +9,13 @@
 import glob
 import hashlib
 import importlib
+import importlib.machinery
+import importlib.util
+import json
 import os
 import re
 import shutil
+import sys
 import uuid
 
 import torch
@@ -23,6 +27,10 @@ from torch.utils.file_baton import FileBaton
 
 verbosity = 'brief' # Verbosity level: 'none', 'brief', 'full'
 
+# Directory of ahead-of-time built plugins (see torch_utils/build_ops.py).
+prebuilt_dir = os.environ.get('TORCH_UTILS_PREBUILT_DIR', os.path.join(os.path.dirname(__file__), 'prebuilt'))
+export_prebuilt = False # Copy freshly built plugins into prebuilt_dir.
+
 #----------------------------------------------------------------------------
 # Internal helper funcs.
 
@@ -51,6 +59,50 @@ def _get_mangled_gpu_name():
             out.append('-')
     return ''.join(out)
 
+#----------------------------------------------------------------------------
+# Prebuilt plugin artifacts, stored as
+# <prebuilt_dir>/<module_name>/<source digest>-torch<version>-cuda<version>-<gpu>/<module_name><ext>
+
+def _source_digest(all_source_files):
+    hash_md5 = hashlib.md5()
+    for src in all_source_files:
+        with open(src, 'rb') as f:
+            hash_md5.update(f.read())
+    return hash_md5.hexdigest()
+
+def _prebuilt_artifact_dir(module_name, source_digest):
+    key = f'{source_digest}-torch{torch.__version__}-cuda{torch.version.cuda}-{_get_mangled_gpu_name()}'
+    return os.path.join(prebuilt_dir, module_name, re.sub('[^A-Za-z0-9_.+-]', '-', key))
+
+def _find_prebuilt(module_name, artifact_dir):
+    for suffix in importlib.machinery.EXTENSION_SUFFIXES + ['.so', '.pyd']:
+        path = os.path.join(artifact_dir, module_name + suffix)
+        if os.path.isfile(path):
+            return path
+    return None
+
+def _load_prebuilt(module_name, path):
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    sys.modules[module_name] = module
+    return module
+
+def _export_prebuilt(module, artifact_dir, source_digest):
+    if _find_prebuilt(module.__name__, artifact_dir) is not None:
+        return
+    tmpdir = f'{artifact_dir}.tmp-{uuid.uuid4().hex}'
+    os.makedirs(tmpdir)
+    shutil.copyfile(module.__file__, os.path.join(tmpdir, os.path.basename(module.__file__)))
+    with open(os.path.join(tmpdir, 'manifest.json'), 'w') as f:
+        json.dump(dict(module=module.__name__, source_digest=source_digest, torch=torch.__version__,
+            cuda=torch.version.cuda, gpu=torch.cuda.get_device_name()), f, indent=2)
+    try:
+        os.replace(tmpdir, artifact_dir) # atomic
+    except OSError:
+        shutil.rmtree(tmpdir)
+        if not os.path.isdir(artifact_dir): raise
+
 #----------------------------------------------------------------------------
 # Main entry point for compiling and loading C++/CUDA plugins.
 
@@ -68,6 +120,27 @@ def get_plugin(module_name, sources, headers=None, source_dir=None, **build_kwar
     if module_name in _cached_plugins:
         return _cached_plugins[module_name]
 
+    # Prebuilt for these sources, this torch version and this GPU? Load it directly,
+    # without going through the compiler checks and ninja.
+    all_source_files = sorted(sources + headers)
+    source_digest = None
+    if torch.cuda.is_available():
+        source_digest = _source_digest(all_source_files)
+        prebuilt_path = _find_prebuilt(module_name, _prebuilt_artifact_dir(module_name, source_digest))
+        if prebuilt_path is not None:
+            try:
+                module = _load_prebuilt(module_name, prebuilt_path)
+            except Exception as e: # pylint: disable=broad-except
+                # Stale or corrupt artifact: fall through to the regular build.
+                sys.modules.pop(module_name, None)
+                if verbosity == 'full':
+                    print(f'Failed to load prebuilt PyTorch plugin "{prebuilt_path}": {e}. Rebuilding.')
+            else:
+                if verbosity == 'full':
+                    print(f'Loaded prebuilt PyTorch plugin "{module_name}" from "{prebuilt_path}".')
+                _cached_plugins[module_name] = module
+                return module
+
     # Print status.
     if verbosity == 'full':
         print(f'Setting up PyTorch plugin "{module_name}"...')
@@ -104,18 +177,14 @@ def get_plugin(module_name, sources, headers=None, source_dir=None, **build_kwar
         # EDIT: We now do it regardless of TORCH_EXTENSIOS_DIR, in order to work
         # around the *.cu dependency bug in ninja config.
         #
-        all_source_files = sorted(sources + headers)
         all_source_dirs = set(os.path.dirname(fname) for fname in all_source_files)
         if len(all_source_dirs) == 1: # and ('TORCH_EXTENSIONS_DIR' in os.environ):
 
             # Compute combined hash digest for all source files.
-            hash_md5 = hashlib.md5()
-            for src in all_source_files:
-                with open(src, 'rb') as f:
-                    hash_md5.update(f.read())
+            if source_digest is None:
+                source_digest = _source_digest(all_source_files)
 
             # Select cached build directory name.
-            source_digest = hash_md5.hexdigest()
             build_top_dir = torch.utils.cpp_extension._get_build_directory(module_name, verbose=verbose_build) # pylint: disable=protected-access
             cached_build_dir = os.path.join(build_top_dir, f'{source_digest}-{_get_mangled_gpu_name()}')
 
@@ -141,6 +210,12 @@ def get_plugin(module_name, sources, headers=None, source_dir=None, **build_kwar
         # Load.
         module = importlib.import_module(module_name)
 
+        # Store as a prebuilt artifact (build_ops.py).
+        if export_prebuilt:
+            if source_digest is None:
+                source_digest = _source_digest(all_source_files)
+            _export_prebuilt(module, _prebuilt_artifact_dir(module_name, source_digest), source_digest)
+
     except:
         if verbosity == 'brief':
             print('Failed!')